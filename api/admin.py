@@ -5,6 +5,7 @@ from .models import *
 # Register your models here.
 admin.site.register(Category)
 admin.site.register(Product)
+admin.site.register(Tag)
 admin.site.register(CouponUsage)
 admin.site.register(Coupon)
 admin.site.register(Offer)
@@ -0,0 +1,39 @@
+import time
+from django.core.cache import cache
+
+# Every cached facet count is keyed under this version
+PRODUCT_FACETS_VERSION_KEY = 'product_facets:version'
+
+
+def get_cache_version(key):
+    """
+    Returns the current version stored under key, creating it if the cache lost it.
+    New versions start from the clock so an evicted counter never reuses an old value.
+    """
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_cache_version(key):
+    """Invalidates everything cached against key by moving it to a new version."""
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), timeout=None)
+        return cache.get(key)
+
+
+def product_version_key(product_id):
+    return f'product:{product_id}:version'
+
+
+def invalidate_product_cache(product_ids):
+    """
+    Moves the given products to new versions; the next read starts a fresh one.
+    Facet counts span many products and are dropped as a whole.
+    """
+    cache.delete_many([product_version_key(product_id) for product_id in product_ids])
+    bump_cache_version(PRODUCT_FACETS_VERSION_KEY)
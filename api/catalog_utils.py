@@ -0,0 +1,367 @@
+import csv
+import io
+import json
+import zlib
+from itertools import islice
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Prefetch
+from rest_framework.exceptions import ValidationError
+from rest_framework.serializers import as_serializer_error
+from .cache_utils import invalidate_product_cache
+from .image_utils import needs_derivatives, schedule_derivatives
+from .models import Category, Product, VariantDetail, VariantOption
+from .pricing_utils import OfferResolver
+from .search_utils import update_search_index
+from .tag_utils import sync_product_tags
+from .variant_utils import bulk_create_variants
+
+CATALOG_FORMATS = ('csv', 'jsonl')
+CATALOG_IMPORT_BATCH_SIZE = 500
+# Errors kept in a report; the rest are only counted so memory stays bounded
+CATALOG_IMPORT_MAX_ERRORS = 1000
+PRODUCT_IMPORT_FIELDS = (
+    'name', 'description', 'sku', 'original_price', 'current_price', 'size', 'weight',
+    'burning_time', 'color', 'fragrance', 'in_the_box', 'stock', 'tags', 'image_url',
+)
+VARIANT_IMPORT_FIELDS = ('original_price', 'current_price', 'stock', 'variant_data')
+CATALOG_EXPORT_CHUNK_SIZE = 2000
+CATALOG_EXPORT_COLUMNS = ('id', 'category', *PRODUCT_IMPORT_FIELDS, 'price_with_offer', 'variants')
+
+def detect_catalog_format(name):
+    """Guesses csv or jsonl from a file name, None when it can't tell."""
+    name = (name or '').lower()
+    if name.endswith('.csv'):
+        return 'csv'
+    if name.endswith(('.jsonl', '.ndjson', '.json')):
+        return 'jsonl'
+    return None
+
+
+def read_catalog_rows(stream, fmt):
+    """
+    Lazily parses a text stream into (line, data, error) tuples.
+    In CSV the optional `variants` column holds a JSON list; empty cells are
+    treated as missing.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            data = {key: value for key, value in row.items() if key and value not in ('', None)}
+            error = None
+            if 'variants' in data:
+                try:
+                    data['variants'] = json.loads(data['variants'])
+                except ValueError as exc:
+                    error = f"variants is not valid JSON: {exc}"
+            yield reader.line_num, data, error
+    elif fmt == 'jsonl':
+        for line, text in enumerate(stream, start=1):
+            if not text.strip():
+                continue
+            try:
+                data = json.loads(text)
+            except ValueError as exc:
+                yield line, None, f"Invalid JSON: {exc}"
+                continue
+            if not isinstance(data, dict):
+                yield line, None, "Each line must be a JSON object."
+                continue
+            yield line, data, None
+    else:
+        raise ValueError(f"Unsupported catalog format {fmt!r}, expected one of {', '.join(CATALOG_FORMATS)}.")
+
+
+def iter_catalog_export(fmt, chunk_size=CATALOG_EXPORT_CHUNK_SIZE):
+    """
+    Yields the whole catalog as CSV or JSONL text, one string per chunk of
+    products, in the format import_catalog reads back plus price_with_offer.
+    Products stream from a server-side cursor (chunked fetches on SQLite) with
+    their variants prefetched per chunk, and every offer price comes from one
+    in-memory OfferResolver, so memory stays flat whatever the catalog size.
+    """
+    if fmt not in CATALOG_FORMATS:
+        raise ValueError(f"Unsupported catalog format {fmt!r}, expected one of {', '.join(CATALOG_FORMATS)}.")
+    resolver = OfferResolver()
+    products = (
+        Product.objects.order_by('id')
+        .only('id', 'category_id', 'effective_price', *PRODUCT_IMPORT_FIELDS)
+        .prefetch_related(Prefetch(
+            'variants',
+            queryset=VariantDetail.objects.order_by('id').prefetch_related(
+                Prefetch('variant_options', queryset=VariantOption.objects.only('id'))
+            ),
+        ))
+        .iterator(chunk_size=chunk_size)
+    )
+
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(CATALOG_EXPORT_COLUMNS)
+    while True:
+        chunk = list(islice(products, chunk_size))
+        if not chunk:
+            return
+        records = (_export_record(product, resolver) for product in chunk)
+        if fmt == 'csv':
+            for record in records:
+                record['variants'] = json.dumps(record['variants'], cls=DjangoJSONEncoder)
+                writer.writerow(record[column] for column in CATALOG_EXPORT_COLUMNS)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        else:
+            yield ''.join(json.dumps(record, cls=DjangoJSONEncoder) + '\n' for record in records)
+
+
+def _export_record(product, resolver):
+    record = {'id': product.id, 'category': product.category_id}
+    record.update((field, getattr(product, field)) for field in PRODUCT_IMPORT_FIELDS)
+    record['price_with_offer'] = resolver.get_effective_price(product.id, product.category_id, product.current_price)
+    record['variants'] = [
+        {
+            **{field: getattr(variant, field) for field in VARIANT_IMPORT_FIELDS},
+            'variant_options': [option.id for option in variant.variant_options.all()],
+            'price_with_offer': resolver.get_effective_price(product.id, product.category_id, variant.current_price),
+        }
+        for variant in product.variants.all()
+    ]
+    return record
+
+
+def gzip_stream(chunks):
+    """Compresses an iterable of text chunks into a gzip byte stream."""
+    compressor = zlib.compressobj(wbits=31)  # 31: gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def open_catalog_upload(uploaded_file):
+    """Wraps an uploaded (binary) file so it can be read line by line as text."""
+    return io.TextIOWrapper(uploaded_file, encoding='utf-8-sig', newline='')
+
+
+class CatalogImportReport:
+    def __init__(self, max_errors=CATALOG_IMPORT_MAX_ERRORS):
+        self.max_errors = max_errors
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.variants = 0
+        self.variants_unchanged = 0
+        self.variants_deleted = 0
+        self.failed = 0
+        self.errors = []
+
+    def add_error(self, line, sku, errors):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'line': line, 'sku': sku, 'errors': errors})
+
+    def as_dict(self):
+        return {
+            'created': self.created,
+            'updated': self.updated,
+            'unchanged': self.unchanged,
+            'variants': self.variants,
+            'variants_unchanged': self.variants_unchanged,
+            'variants_deleted': self.variants_deleted,
+            'failed': self.failed,
+            'errors': self.errors,
+            'errors_truncated': self.failed > len(self.errors),
+        }
+
+
+def import_catalog(rows, batch_size=CATALOG_IMPORT_BATCH_SIZE, report=None):
+    """
+    Imports (line, data, error) rows from read_catalog_rows() batch by batch,
+    so memory use depends on the batch size and not on the file.
+    Products are upserted by sku; variants given for a product replace its
+    variants, matched by option set so unchanged variants keep their ids.
+    A bad row is reported and skipped, the rest of its batch is still
+    imported. Each batch commits on its own.
+    """
+    report = report or CatalogImportReport()
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return report
+        _import_batch(batch, report)
+
+
+def _validate_batch(batch, report):
+    """Returns {sku: (line, validated data)}; the last row wins for a repeated sku."""
+    from .serializers import CatalogRowSerializer
+
+    # One serializer validates every row so its fields are only built once
+    serializer = CatalogRowSerializer()
+    valid = {}
+    for line, data, error in batch:
+        if error:
+            report.add_error(line, data.get('sku') if data else None, {'non_field_errors': [error]})
+            continue
+        try:
+            validated = serializer.run_validation(data)
+        except ValidationError as exc:
+            report.add_error(line, data.get('sku'), as_serializer_error(exc))
+            continue
+        valid[validated['sku']] = (line, validated)
+
+    # Referenced ids are checked with one query per kind for the whole batch
+    category_ids = set(Category.objects.filter(
+        id__in={data['category'] for _, data in valid.values()}
+    ).values_list('id', flat=True))
+    option_ids = set(VariantOption.objects.filter(id__in={
+        option_id
+        for _, data in valid.values()
+        for variant in data.get('variants', [])
+        for option_id in variant['variant_options']
+    }).values_list('id', flat=True))
+
+    for sku, (line, data) in list(valid.items()):
+        errors = {}
+        if data['category'] not in category_ids:
+            errors['category'] = [f'Invalid pk "{data["category"]}" - object does not exist.']
+        missing = sorted({
+            option_id for variant in data.get('variants', []) for option_id in variant['variant_options']
+        } - option_ids)
+        if missing:
+            errors['variants'] = [f"Invalid variant options: {', '.join(map(str, missing))}."]
+        if errors:
+            report.add_error(line, sku, errors)
+            del valid[sku]
+    return valid
+
+
+def _import_batch(batch, report):
+    valid = _validate_batch(batch, report)
+    if not valid:
+        return
+
+    with transaction.atomic():
+        # Ordered so the oldest product wins when a sku already exists more than once
+        existing = {
+            product.sku: product
+            for product in Product.objects.filter(sku__in=valid).order_by('-id').only(
+                'id', 'category_id', 'effective_price', 'image_derivatives', *PRODUCT_IMPORT_FIELDS
+            )
+        }
+        resolver = OfferResolver()
+        to_create, to_update, unchanged = [], [], []
+        changed_fields = set()
+        for sku, (line, data) in valid.items():
+            values = {field: data[field] for field in PRODUCT_IMPORT_FIELDS if field in data}
+            values['category_id'] = data['category']
+            product = existing.get(sku)
+            if product is None:
+                product = Product(**values)
+                product.effective_price = resolver.get_effective_price(None, product.category_id, product.current_price)
+                to_create.append(product)
+                continue
+            values['effective_price'] = resolver.get_effective_price(
+                product.id, values['category_id'], values['current_price']
+            )
+            # Only rows that differ are written back, re-imports of an unchanged feed are cheap
+            changed = {field for field, value in values.items() if getattr(product, field) != value}
+            for field in changed:
+                setattr(product, field, values[field])
+            changed_fields |= changed
+            (to_update if changed else unchanged).append(product)
+
+        Product.objects.bulk_create(to_create)
+        if to_update:
+            Product.objects.bulk_update(to_update, changed_fields)
+        products = to_create + to_update + unchanged
+
+        with_variants = [product for product in products if 'variants' in valid[product.sku][1]]
+        variant_changes = _sync_variants(with_variants, valid, existing, resolver)
+        # A product whose variants changed was updated, even if its own fields weren't
+        variants_changed = variant_changes['changed_product_ids']
+        moved = [product for product in unchanged if product.pk in variants_changed]
+        unchanged = [product for product in unchanged if product.pk not in variants_changed]
+
+        # bulk_create and bulk_update skip the save signals, so their work is done here
+        written = to_create + to_update
+        sync_product_tags(written)
+        update_search_index([product.pk for product in written])
+        stale_ids = {product.pk for product in written} | variants_changed
+        transaction.on_commit(lambda: invalidate_product_cache(stale_ids))
+        new_images = [product.pk for product in written if needs_derivatives(product)]
+        transaction.on_commit(lambda: schedule_derivatives('api.product', new_images))
+
+    report.created += len(to_create)
+    report.updated += len(to_update) + len(moved)
+    report.unchanged += len(unchanged)
+    report.variants += variant_changes['written']
+    report.variants_unchanged += variant_changes['unchanged']
+    report.variants_deleted += variant_changes['deleted']
+
+
+def _sync_variants(products, valid, existing, resolver):
+    """
+    Upserts the variants of products by (product, option signature): changed
+    variants are updated in place, missing ones inserted, and only the
+    variants a row no longer lists are deleted. Keeping the rows keeps the
+    variant ids that carts and order items point at.
+    """
+    current = {}
+    stale = []
+    if any(product.sku in existing for product in products):
+        for variant in VariantDetail.objects.filter(
+            product_id__in=[product.pk for product in products if product.sku in existing]
+        ).order_by('id').only('id', 'product_id', 'option_signature', 'effective_price', *VARIANT_IMPORT_FIELDS):
+            # Only the oldest of repeated option sets is kept
+            if current.setdefault((variant.product_id, variant.option_signature), variant) is not variant:
+                stale.append(variant.pk)
+
+    defaults = {field: VariantDetail._meta.get_field(field).get_default() for field in VARIANT_IMPORT_FIELDS}
+    to_create, to_update, changed_fields = [], [], set()
+    unchanged = 0
+    changed_product_ids = set()
+    listed = set()
+    for product in products:
+        incoming = {
+            VariantDetail.build_option_signature(variant['variant_options']): variant
+            for variant in valid[product.sku][1]['variants']
+        }
+        for signature, data in incoming.items():
+            values = {**defaults, **{field: data[field] for field in VARIANT_IMPORT_FIELDS if field in data}}
+            variant = current.get((product.pk, signature))
+            if variant is None:
+                to_create.append((VariantDetail(product=product, **values), data['variant_options']))
+                changed_product_ids.add(product.pk)
+                continue
+            listed.add(variant.pk)
+            values['effective_price'] = resolver.get_effective_price(
+                product.pk, product.category_id, values['current_price']
+            )
+            changed = {field for field, value in values.items() if getattr(variant, field) != value}
+            if not changed:
+                unchanged += 1
+                continue
+            for field in changed:
+                setattr(variant, field, values[field])
+            changed_fields |= changed
+            to_update.append(variant)
+            changed_product_ids.add(product.pk)
+
+    removed = stale + [variant.pk for variant in current.values() if variant.pk not in listed]
+    if removed:
+        changed_product_ids.update(
+            VariantDetail.objects.filter(pk__in=removed).values_list('product_id', flat=True)
+        )
+        VariantDetail.objects.filter(pk__in=removed).delete()
+    if to_update:
+        VariantDetail.objects.bulk_update(to_update, changed_fields)
+    bulk_create_variants(to_create, resolver)
+    return {
+        'written': len(to_create) + len(to_update),
+        'unchanged': unchanged,
+        'deleted': len(removed),
+        'changed_product_ids': changed_product_ids,
+    }
@@ -0,0 +1,79 @@
+from django.core.cache import cache
+from django.db import transaction
+from .cache_utils import get_cache_version, bump_cache_version
+from .models import Category
+
+CATEGORY_TREE_VERSION_KEY = 'category_tree:version'
+CATEGORY_TREE_TIMEOUT = 60 * 60 * 24
+CATEGORY_CREATE_FIELDS = ('name', 'description', 'is_active')
+CATEGORY_BULK_BATCH_SIZE = 500
+
+
+def build_category_tree():
+    """
+    Loads every visible category in one query and links the nodes in memory.
+    Each node gets a `tree_children` list that CategoryTreeSerializer reads
+    instead of querying `subcategories`. Returns the root nodes.
+    """
+    categories = list(Category.objects.filter(is_visible=True).order_by('depth', 'id'))
+    nodes = {category.id: category for category in categories}
+    roots = []
+    for category in categories:
+        category.tree_children = []
+        if category.parent_id is None:
+            roots.append(category)
+        elif category.parent_id in nodes:
+            nodes[category.parent_id].tree_children.append(category)
+    return roots
+
+
+def get_category_tree_data():
+    """
+    Returns the serialized active category tree, served from the cache until
+    a Category is saved or deleted.
+    """
+    from .serializers import CategoryTreeSerializer
+
+    cache_key = f"category_tree:{get_cache_version(CATEGORY_TREE_VERSION_KEY)}"
+    data = cache.get(cache_key)
+    if data is None:
+        data = CategoryTreeSerializer(build_category_tree(), many=True).data
+        cache.set(cache_key, data, timeout=CATEGORY_TREE_TIMEOUT)
+    return data
+
+
+def invalidate_category_tree():
+    bump_cache_version(CATEGORY_TREE_VERSION_KEY)
+
+
+def _new_category(data, parent):
+    category = Category(parent=parent, **{key: data[key] for key in CATEGORY_CREATE_FIELDS if key in data})
+    category.depth = parent.depth + 1 if parent else 0
+    category.is_visible = category.is_active and (parent.is_visible if parent else True)
+    return category
+
+
+@transaction.atomic
+def create_category_trees(trees):
+    """
+    Creates nested categories with one bulk insert per tree level.
+    `trees` is a list of dicts holding the category fields, an optional
+    `parent` Category and nested `subcategories` dicts. Returns the roots.
+    """
+    level = [(_new_category(data, data.get('parent')), data.get('subcategories') or []) for data in trees]
+    roots = [category for category, _ in level]
+    while level:
+        categories = [category for category, _ in level]
+        Category.objects.bulk_create(categories, batch_size=CATEGORY_BULK_BATCH_SIZE)
+        for category in categories:
+            category.path = Category.build_path(category.parent.path if category.parent else '', category.pk)
+        Category.objects.bulk_update(categories, ['path'], batch_size=CATEGORY_BULK_BATCH_SIZE)
+
+        level = [
+            (_new_category(child_data, category), child_data.get('subcategories') or [])
+            for category, children_data in level
+            for child_data in children_data
+        ]
+
+    transaction.on_commit(invalidate_category_tree)
+    return roots
@@ -1,25 +1,118 @@
+from functools import reduce
+from operator import or_
 from django.core.mail import send_mail
 from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
 from .models import Cart ,Coupon , CouponUsage
 from .tasks import send_otp_email_task , send_notification_email
 
+CART_TABLE = Cart._meta.db_table
+
 
 def send_otp_email(email, otp):
     send_otp_email_task.delay(email, otp)
 
+def upsert_cart_items(user_id, quantities, replace=False):
+    """
+    Adds quantities to a user's cart items, or sets them with replace=True,
+    creating the missing items, with a single INSERT ... ON CONFLICT DO UPDATE
+    per kind of item (with and without a variant). The arithmetic happens in
+    the database, so concurrent adds never lose an update or create a
+    duplicate item. `quantities` maps (product_id, variant_id or None) to a
+    positive quantity. Returns {(product_id, variant_id): new quantity}.
+    """
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+    quantity = "excluded.quantity" if replace else f"{CART_TABLE}.quantity + excluded.quantity"
+    results = {}
+    for with_variant in (False, True):
+        rows = [(key, value) for key, value in quantities.items() if (key[1] is not None) == with_variant]
+        if not rows:
+            continue
+        # The conflict target must name the partial unique index the row falls under
+        if with_variant:
+            conflict = "(user_id, product_id, variant_id) WHERE variant_id IS NOT NULL"
+        else:
+            conflict = "(user_id, product_id) WHERE variant_id IS NULL"
+        params = []
+        for (product_id, variant_id), value in rows:
+            params += [user_id, product_id, variant_id, value, now, now, True]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {CART_TABLE} "
+                "(user_id, product_id, variant_id, quantity, created_at, updated_at, is_active) "
+                f"VALUES {', '.join(['(%s, %s, %s, %s, %s, %s, %s)'] * len(rows))} "
+                f"ON CONFLICT {conflict} DO UPDATE SET "
+                f"quantity = {quantity}, updated_at = excluded.updated_at "
+                "RETURNING product_id, variant_id, quantity",
+                params,
+            )
+            results.update(((product_id, variant_id), value) for product_id, variant_id, value in cursor.fetchall())
+    return results
+
+
+def _take_from_cart_item(items, quantity):
+    """
+    Takes quantity (positive) off the item in `items`, deleting it once
+    nothing would be left. The update goes first: its WHERE is re-checked
+    after the row lock, so a concurrent decrement can't drive it below zero.
+    """
+    with transaction.atomic():
+        if not items.filter(quantity__gt=quantity).update(quantity=F('quantity') - quantity, updated_at=timezone.now()):
+            items.filter(quantity__lte=quantity).delete()
+
+
 def add_or_update_cart(user, product, variant, quantity):
-    try:
-        cart_item = Cart.objects.get(user=user, product=product, variant=variant)
-        cart_item.quantity += quantity
+    """
+    Adds quantity (negative to take some away) to the user's cart item for
+    product and variant. Adding is one upsert statement; taking away updates
+    the quantity in place and deletes the item once nothing is left.
+    """
+    if quantity > 0:
+        upsert_cart_items(user.pk, {(product.pk, variant.pk if variant else None): quantity})
+    elif quantity < 0:
+        _take_from_cart_item(Cart.objects.filter(user=user, product=product, variant=variant), -quantity)
+
 
-        if cart_item.quantity <= 0:
-            cart_item.delete()
+def apply_cart_operations(user, operations):
+    """
+    Applies validated cart operations (dicts with op, product, variant and
+    quantity) in one transaction. Operations on the same item are folded in
+    order first, so every item is written once: set and remove leave a final
+    quantity, adds alone leave a change to the current one. The final
+    quantities and positive changes are each written with one bulk upsert.
+    """
+    folded = {}
+    for operation in operations:
+        key = (operation['product'], operation['variant'])
+        kind, quantity = folded.get(key, ('add', 0))
+        if operation['op'] == 'add':
+            quantity += operation['quantity']
+            folded[key] = (kind, max(quantity, 0) if kind == 'set' else quantity)
+        elif operation['op'] == 'set':
+            folded[key] = ('set', operation['quantity'])
         else:
-            cart_item.save()
+            folded[key] = ('set', 0)
 
-    except Cart.DoesNotExist:
-        if quantity > 0:
-            Cart.objects.create(user=user, product=product, variant=variant, quantity=quantity)
+    removed = [key for key, (kind, quantity) in folded.items() if kind == 'set' and quantity == 0]
+    with transaction.atomic():
+        if removed:
+            Cart.objects.filter(
+                reduce(or_, (Q(product_id=product_id, variant_id=variant_id) for product_id, variant_id in removed)),
+                user=user,
+            ).delete()
+        upsert_cart_items(user.pk, {
+            key: quantity for key, (kind, quantity) in folded.items() if kind == 'set' and quantity > 0
+        }, replace=True)
+        upsert_cart_items(user.pk, {
+            key: quantity for key, (kind, quantity) in folded.items() if kind == 'add' and quantity > 0
+        })
+        for (product_id, variant_id), (kind, quantity) in folded.items():
+            if kind == 'add' and quantity < 0:
+                _take_from_cart_item(
+                    Cart.objects.filter(user=user, product_id=product_id, variant_id=variant_id), -quantity
+                )
 
 
 def apply_coupon_to_order(coupon_code, order, user):
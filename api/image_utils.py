@@ -0,0 +1,189 @@
+import hashlib
+import io
+import tempfile
+from contextlib import contextmanager
+import requests
+from PIL import Image, ImageOps, UnidentifiedImageError
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models import Q
+
+# Longest edge of each derivative, in pixels; images are never upscaled
+IMAGE_DERIVATIVE_SIZES = {'thumb': 160, 'small': 320, 'medium': 640, 'large': 1280}
+# Output format -> (file extension, Pillow format, save options)
+IMAGE_DERIVATIVE_FORMATS = {
+    'webp': ('webp', 'WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('jpg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+IMAGE_DERIVATIVE_ROOT = 'derivatives'
+# Model label -> (source field, derivatives JSON field); the product image is a remote URL
+IMAGE_DERIVATIVE_FIELDS = {
+    'api.product': ('image_url', 'image_derivatives'),
+    'api.extendedusermodel': ('profile_photo', 'profile_photo_derivatives'),
+    'api.testimonial': ('profile_image', 'profile_image_derivatives'),
+}
+IMAGE_DOWNLOAD_TIMEOUT = 10
+IMAGE_DOWNLOAD_MAX_BYTES = 20 * 1024 * 1024
+# Sources are spooled to disk past this size instead of held in memory
+IMAGE_SPOOL_MAX_MEMORY = 1024 * 1024
+IMAGE_READ_CHUNK_SIZE = 64 * 1024
+
+
+class ImageSourceError(Exception):
+    """The source image can't be fetched or decoded; retrying won't help."""
+
+
+def image_source(instance):
+    """The current source of instance's image: a storage name or a URL, '' when there is none."""
+    source_field, _ = IMAGE_DERIVATIVE_FIELDS[instance._meta.label_lower]
+    value = getattr(instance, source_field)
+    return (getattr(value, 'name', value) or '') if value else ''
+
+
+def needs_derivatives(instance):
+    """True when the stored derivatives were not generated from the current source."""
+    _, derivatives_field = IMAGE_DERIVATIVE_FIELDS[instance._meta.label_lower]
+    return image_source(instance) != (getattr(instance, derivatives_field) or {}).get('source', '')
+
+
+@contextmanager
+def open_image_source(instance):
+    """
+    Yields the source image as a seekable binary file. Stored files are read
+    from storage; URLs are downloaded in chunks into a spooled temporary file,
+    so neither is buffered whole in memory.
+    """
+    source_field, _ = IMAGE_DERIVATIVE_FIELDS[instance._meta.label_lower]
+    value = getattr(instance, source_field)
+    if hasattr(value, 'open'):
+        with value.open('rb') as source:
+            yield source
+        return
+
+    with tempfile.SpooledTemporaryFile(max_size=IMAGE_SPOOL_MAX_MEMORY) as spool:
+        with requests.get(value, stream=True, timeout=IMAGE_DOWNLOAD_TIMEOUT) as response:
+            if 400 <= response.status_code < 500:
+                raise ImageSourceError(f"{value} returned {response.status_code}")
+            response.raise_for_status()
+            size = 0
+            for chunk in response.iter_content(IMAGE_READ_CHUNK_SIZE):
+                size += len(chunk)
+                if size > IMAGE_DOWNLOAD_MAX_BYTES:
+                    raise ImageSourceError(f"{value} is larger than {IMAGE_DOWNLOAD_MAX_BYTES} bytes")
+                spool.write(chunk)
+        spool.seek(0)
+        yield spool
+
+
+def _content_digest(source):
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: source.read(IMAGE_READ_CHUNK_SIZE), b''):
+        digest.update(chunk)
+    source.seek(0)
+    return digest.hexdigest()[:20]
+
+
+def _encode(image, fmt):
+    _, pil_format, options = IMAGE_DERIVATIVE_FORMATS[fmt]
+    if pil_format == 'JPEG' and image.mode != 'RGB':
+        # JPEG has no alpha channel: flatten transparent images onto white
+        background = Image.new('RGB', image.size, 'white')
+        if image.mode in ('RGBA', 'LA'):
+            background.paste(image, mask=image.getchannel('A'))
+        else:
+            background.paste(image.convert('RGB'))
+        image = background
+    output = io.BytesIO()
+    image.save(output, pil_format, **options)
+    return output.getvalue()
+
+
+def render_derivatives(source, prefix):
+    """
+    Writes every size and format of the image in source to storage and
+    returns {size: {'width', 'height', 'webp', 'jpeg'}} with storage names.
+    Names are derived from the image content, so they never change meaning
+    (cacheable forever) and identical uploads share their files.
+    """
+    digest = _content_digest(source)
+    try:
+        image = Image.open(source)
+        largest = max(IMAGE_DERIVATIVE_SIZES.values())
+        # Lets JPEG decode straight at a reduced scale instead of full resolution
+        image.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+    except (UnidentifiedImageError, OSError):
+        raise ImageSourceError("Not a readable image")
+
+    sizes = {}
+    entry = None
+    # Largest first, each size is scaled down from the previous one
+    for name, edge in sorted(IMAGE_DERIVATIVE_SIZES.items(), key=lambda item: -item[1]):
+        if entry is not None and max(image.size) <= edge:
+            # Smaller than this size already: share the files of the previous one
+            sizes[name] = entry
+            continue
+        image = image.copy()
+        image.thumbnail((edge, edge), Image.LANCZOS)
+        entry = {'width': image.width, 'height': image.height}
+        for fmt in IMAGE_DERIVATIVE_FORMATS:
+            extension = IMAGE_DERIVATIVE_FORMATS[fmt][0]
+            path = f"{IMAGE_DERIVATIVE_ROOT}/{prefix}/{digest}-{edge}.{extension}"
+            if not default_storage.exists(path):
+                path = default_storage.save(path, ContentFile(_encode(image, fmt)))
+            entry[fmt] = path
+        sizes[name] = entry
+    return sizes
+
+
+def generate_derivatives(instance):
+    """
+    Renders the derivatives of instance's current image and stores them,
+    unless the source changed meanwhile (a newer task handles that one).
+    An undecodable source is recorded with its error so it isn't retried.
+    """
+    source_field, derivatives_field = IMAGE_DERIVATIVE_FIELDS[instance._meta.label_lower]
+    source = image_source(instance)
+    if not source:
+        derivatives = {}
+    else:
+        try:
+            with open_image_source(instance) as image_file:
+                derivatives = {'source': source, 'sizes': render_derivatives(image_file, instance._meta.model_name)}
+        except ImageSourceError as exc:
+            derivatives = {'source': source, 'sizes': {}, 'error': str(exc)}
+
+    if source:
+        unchanged = Q(**{source_field: source})
+    else:
+        unchanged = Q(**{source_field: ''}) | Q(**{f'{source_field}__isnull': True})
+    updated = type(instance).objects.filter(unchanged, pk=instance.pk).update(**{derivatives_field: derivatives})
+    if updated and instance._meta.label_lower == 'api.product':
+        from .cache_utils import invalidate_product_cache
+
+        invalidate_product_cache([instance.pk])
+    return derivatives
+
+
+def schedule_derivatives(model_label, pks):
+    """Queues derivative generation; a broker outage must not fail the caller's request."""
+    from .tasks import generate_image_derivatives_task
+
+    for pk in pks:
+        try:
+            generate_image_derivatives_task.delay(model_label, pk)
+        except Exception as e:
+            print(f"Error scheduling image derivatives for {model_label} {pk}: {e}")
+
+
+def derivative_urls(derivatives, request=None):
+    """{size: {'width', 'height', 'webp': url, 'jpeg': url}} for a derivatives field value."""
+    urls = {}
+    for name, entry in ((derivatives or {}).get('sizes') or {}).items():
+        urls[name] = dict(entry)
+        for fmt in IMAGE_DERIVATIVE_FORMATS:
+            url = default_storage.url(entry[fmt])
+            urls[name][fmt] = request.build_absolute_uri(url) if request is not None else url
+    return urls
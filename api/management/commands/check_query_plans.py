@@ -0,0 +1,150 @@
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from api.models import Cart, Category, Message, Offer, Order, Product, Review, VariantDetail
+
+
+class Rollback(Exception):
+    """Raised to throw the seeded rows away once the plans are checked."""
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds throwaway data inside a transaction, EXPLAINs the hot catalog, cart, "
+        "order, review and message queries and fails if any of them scans a table "
+        "instead of using an index. Nothing is left in the database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=2000, help='Rows seeded per table (default 2000).')
+        parser.add_argument('--verbose-plans', action='store_true', help='Print every plan in full.')
+
+    def handle(self, *args, **options):
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            raise CommandError(f"Query plans can only be checked on SQLite or Postgres, not {connection.vendor}.")
+
+        failures = []
+        try:
+            with transaction.atomic():
+                fixtures = self.seed(options['rows'])
+                with connection.cursor() as cursor:
+                    # Plan with statistics of the seeded data, as production would
+                    cursor.execute('ANALYZE')
+                    if connection.vendor == 'postgresql':
+                        # Small seeded tables would otherwise be sequentially scanned by choice;
+                        # this proves an index *can* serve each query
+                        cursor.execute('SET LOCAL enable_seqscan = off')
+
+                for name, queryset in self.hot_queries(**fixtures):
+                    plan = queryset.explain()
+                    problem = self.plan_problem(plan)
+                    if problem:
+                        failures.append(name)
+                        self.stdout.write(self.style.ERROR(f"FAIL  {name}: {problem}"))
+                    else:
+                        self.stdout.write(self.style.SUCCESS(f"ok    {name}"))
+                    if problem or options['verbose_plans']:
+                        self.stdout.write(plan)
+                raise Rollback
+        except Rollback:
+            pass
+
+        if failures:
+            raise CommandError(f"{len(failures)} hot queries do not use an index: {', '.join(failures)}")
+        self.stdout.write(self.style.SUCCESS('Every hot query uses an index.'))
+
+    def plan_problem(self, plan):
+        """Returns why plan is not index backed, or None."""
+        if connection.vendor == 'postgresql':
+            if 'Seq Scan' in plan:
+                return 'sequential scan'
+            if 'Index' not in plan:
+                return 'no index used'
+            return None
+        for line in plan.splitlines():
+            # Django renders each SQLite plan row as "<id> <parent> <notused> <detail>"
+            detail = line.split(maxsplit=3)[-1]
+            if detail.startswith('SCAN ') and 'INDEX' not in detail:
+                return 'full table scan'
+            if 'TEMP B-TREE' in detail:
+                return 'sort not served by an index'
+        return None
+
+    def seed(self, rows):
+        """Bulk inserts rows of each table around one user, product, variant and order."""
+        now = timezone.now()
+        tag = uuid.uuid4().hex[:8]
+        users = User.objects.bulk_create(
+            [User(username=f'plan-{tag}-{index}') for index in range(max(rows // 20, 2))]
+        )
+        category = Category.objects.create(name=f'plan-{tag}')
+        Category.objects.create(name=f'plan-{tag}-child', parent=category)
+        # Products spread over many trees, so a subtree holds a small share of them as in a real catalog
+        categories = [category] + [Category.objects.create(name=f'plan-{tag}-{index}') for index in range(49)]
+        products = Product.objects.bulk_create([
+            Product(
+                name=f'plan product {index}', description='', category=categories[index % len(categories)],
+                sku=f'plan-{tag}-{index}',
+                original_price=Decimal('10'), current_price=Decimal('10'), effective_price=Decimal('10'),
+                size='', weight=Decimal('1'), burning_time='', color='', fragrance='', in_the_box='', stock=1,
+            )
+            for index in range(rows)
+        ])
+        variant = VariantDetail.objects.create(
+            product=products[0], original_price=Decimal('10'), current_price=Decimal('10'),
+        )
+        orders = Order.objects.bulk_create([
+            Order(
+                user=users[index % len(users)], order_number=f'P{tag}{index}', total_price=Decimal('10'),
+                created_at=now - timedelta(minutes=index),
+            )
+            for index in range(rows)
+        ])
+        Cart.objects.bulk_create([
+            Cart(user=users[index % len(users)], product=products[index], is_active=index % 3 != 0)
+            for index in range(rows)
+        ])
+        Review.objects.bulk_create([
+            Review(product=products[index % 50], user=users[index % len(users)], review_text='', approved=index % 2 == 0)
+            for index in range(rows)
+        ])
+        Message.objects.bulk_create([
+            Message(order=orders[index % 50], sender=users[index % len(users)], content='')
+            for index in range(rows)
+        ])
+        Offer.objects.bulk_create([
+            Offer(
+                name=f'plan offer {index}', offer_type='product' if index % 2 else 'category',
+                discount_type='percentage', discount_value=Decimal('5'),
+                product=products[index] if index % 2 else None, category=None if index % 2 else category,
+                start_date=now - timedelta(days=index % 30), end_date=now + timedelta(days=index % 30 - 15),
+                is_active=index % 4 != 0,
+            )
+            for index in range(rows)
+        ])
+        return {'now': now, 'user': users[0], 'product': products[0], 'variant': variant, 'order': orders[0],
+                'category': category}
+
+    def hot_queries(self, now, user, product, variant, order, category):
+        return [
+            ('offer by product', Offer.objects.filter(
+                product=product, is_active=True, start_date__lte=now, end_date__gte=now)),
+            ('offer by category', Offer.objects.filter(
+                category=category, is_active=True, start_date__lte=now, end_date__gte=now)),
+            ('active offers', Offer.objects.filter(is_active=True, end_date__gte=now)),
+            ('active cart', Cart.objects.filter(user=user, is_active=True)),
+            ('cart item', Cart.objects.filter(user=user, product=product, variant=variant)),
+            ('approved reviews', Review.objects.filter(product=product, approved=True).order_by('-created_at')),
+            ('pending reviews', Review.objects.filter(product=product, approved=False).order_by('-created_at')),
+            ('product reviews', Review.objects.filter(product=product).order_by('-created_at')),
+            ('order messages', Message.objects.filter(order=order)),
+            ('sender messages', Message.objects.filter(order=order, sender=user).order_by('-created_at')),
+            ('order history', Order.objects.filter(user=user).order_by('-created_at')),
+            ('category subtree', Category.objects.filter(Category.subtree_q(category.path), is_visible=True)),
+            ('subtree products', Product.objects.filter(category_id__in=Category.objects.filter(
+                Category.subtree_q(category.path), is_visible=True).values('id'))),
+        ]
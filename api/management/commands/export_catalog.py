@@ -0,0 +1,42 @@
+import gzip
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from api.catalog_utils import CATALOG_EXPORT_CHUNK_SIZE, CATALOG_FORMATS, detect_catalog_format, iter_catalog_export
+
+
+class Command(BaseCommand):
+    help = (
+        "Streams the whole catalog to a CSV or JSONL file in the format import_catalog "
+        "reads, with offer prices resolved. Memory use does not grow with the catalog."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Output file (a .gz suffix compresses it), or - for standard output.")
+        parser.add_argument('--format', choices=CATALOG_FORMATS, help="Defaults to the file extension.")
+        parser.add_argument('--gzip', action='store_true', help="Gzip the output.")
+        parser.add_argument('--chunk-size', type=int, default=CATALOG_EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        compress = options['gzip'] or path.endswith('.gz')
+        fmt = options['format'] or detect_catalog_format(path.removesuffix('.gz'))
+        if fmt is None:
+            raise CommandError("Can't tell the catalog format from the file name, pass --format.")
+
+        try:
+            if path == '-':
+                stream = gzip.open(sys.stdout.buffer, 'wt', encoding='utf-8') if compress else sys.stdout
+            elif compress:
+                stream = gzip.open(path, 'wt', encoding='utf-8', newline='')
+            else:
+                stream = open(path, 'w', encoding='utf-8', newline='')
+        except OSError as exc:
+            raise CommandError(f"Can't open {path}: {exc}")
+        try:
+            for chunk in iter_catalog_export(fmt, chunk_size=options['chunk_size']):
+                stream.write(chunk)
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+        if path != '-':
+            self.stdout.write(self.style.SUCCESS(f"Catalog exported to {path}"))
@@ -0,0 +1,46 @@
+import json
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from api.catalog_utils import (
+    CATALOG_FORMATS, CATALOG_IMPORT_BATCH_SIZE, CatalogImportReport, detect_catalog_format, import_catalog,
+    read_catalog_rows,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Streams a CSV or JSONL supplier catalog into the database. Products are "
+        "upserted by sku in batches; invalid rows are reported and skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Catalog file, or - to read standard input.")
+        parser.add_argument('--format', choices=CATALOG_FORMATS, help="Defaults to the file extension.")
+        parser.add_argument('--batch-size', type=int, default=CATALOG_IMPORT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or detect_catalog_format(path)
+        if fmt is None:
+            raise CommandError("Can't tell the catalog format from the file name, pass --format.")
+
+        report = CatalogImportReport()
+        try:
+            stream = sys.stdin if path == '-' else open(path, encoding='utf-8-sig', newline='')
+        except OSError as exc:
+            raise CommandError(f"Can't open {path}: {exc}")
+        try:
+            import_catalog(read_catalog_rows(stream, fmt), batch_size=options['batch_size'], report=report)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        for error in report.errors:
+            self.stderr.write(f"line {error['line']} ({error['sku'] or '-'}): {json.dumps(error['errors'])}")
+        if report.failed > len(report.errors):
+            self.stderr.write(f"... {report.failed - len(report.errors)} more errors not shown")
+        self.stdout.write(self.style.SUCCESS(
+            f"{report.created} created, {report.updated} updated, {report.unchanged} unchanged, "
+            f"{report.variants} variants written, {report.variants_unchanged} unchanged, "
+            f"{report.variants_deleted} deleted, {report.failed} failed"
+        ))
@@ -0,0 +1,49 @@
+# Generated by Django 5.1.1 on 2026-10-18 08:41
+
+from django.db import migrations, models
+
+
+def backfill_category_paths(apps, schema_editor):
+    Category = apps.get_model("api", "Category")
+    level = list(Category.objects.filter(parent__isnull=True))
+    for category in level:
+        category.path = f"/{category.pk}/"
+        category.depth = 0
+        category.is_visible = category.is_active
+    while level:
+        Category.objects.bulk_update(level, ["path", "depth", "is_visible"], batch_size=500)
+        parents = {category.pk: category for category in level}
+        level = list(Category.objects.filter(parent_id__in=list(parents)))
+        for category in level:
+            parent = parents[category.parent_id]
+            category.path = f"{parent.path}{category.pk}/"
+            category.depth = parent.depth + 1
+            category.is_visible = category.is_active and parent.is_visible
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0008_testimonial_order_remark_message_review"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="category",
+            name="depth",
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="category",
+            name="is_visible",
+            field=models.BooleanField(db_index=True, default=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name="category",
+            name="path",
+            field=models.CharField(
+                blank=True, db_index=True, default="", editable=False, max_length=255
+            ),
+        ),
+        migrations.RunPython(backfill_category_paths, migrations.RunPython.noop),
+    ]
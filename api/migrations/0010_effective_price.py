@@ -0,0 +1,77 @@
+# Generated by Django 5.1.1 on 2026-10-18 08:45
+
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_effective_prices(apps, schema_editor):
+    Offer = apps.get_model("api", "Offer")
+    Product = apps.get_model("api", "Product")
+    VariantDetail = apps.get_model("api", "VariantDetail")
+
+    now = timezone.now()
+    product_offers = {}
+    category_offers = {}
+    offers = Offer.objects.filter(is_active=True, start_date__lte=now, end_date__gte=now)
+    for offer in offers.order_by("id"):
+        if offer.product_id:
+            product_offers.setdefault(offer.product_id, offer)
+        if offer.category_id:
+            category_offers.setdefault(offer.category_id, offer)
+
+    def effective_price(product_id, category_id, price):
+        offer = product_offers.get(product_id) or category_offers.get(category_id)
+        if offer and offer.discount_type == "percentage":
+            price = price - price * (offer.discount_value / Decimal("100"))
+        elif offer and offer.discount_type == "fixed":
+            price = max(price - offer.discount_value, Decimal("0"))
+        return price.quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+
+    products = list(Product.objects.only("id", "category_id", "current_price"))
+    categories = {}
+    for product in products:
+        categories[product.id] = product.category_id
+        product.effective_price = effective_price(
+            product.id, product.category_id, product.current_price
+        )
+    Product.objects.bulk_update(products, ["effective_price"], batch_size=1000)
+
+    variants = list(VariantDetail.objects.only("id", "product_id", "current_price"))
+    for variant in variants:
+        variant.effective_price = effective_price(
+            variant.product_id, categories.get(variant.product_id), variant.current_price
+        )
+    VariantDetail.objects.bulk_update(variants, ["effective_price"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0009_category_tree_path"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="effective_price",
+            field=models.DecimalField(
+                blank=True, decimal_places=2, editable=False, max_digits=10, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="variantdetail",
+            name="effective_price",
+            field=models.DecimalField(
+                blank=True, decimal_places=2, editable=False, max_digits=10, null=True
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                fields=["effective_price", "id"], name="api_product_effecti_354b74_idx"
+            ),
+        ),
+        migrations.RunPython(backfill_effective_prices, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.1 on 2026-10-18 08:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0010_effective_price"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="offer",
+            index=models.Index(
+                fields=["product", "is_active", "start_date", "end_date"],
+                name="api_offer_product_132a3a_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="offer",
+            index=models.Index(
+                fields=["category", "is_active", "start_date", "end_date"],
+                name="api_offer_categor_e37915_idx",
+            ),
+        ),
+    ]
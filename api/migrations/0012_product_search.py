@@ -0,0 +1,59 @@
+# Generated by Django 5.1.1 on 2026-10-18 08:51
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+FTS_TABLE = "api_product_fts"
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        schema_editor.execute(
+            "CREATE INDEX api_product_search_vector_gin "
+            "ON api_product USING gin (search_vector)"
+        )
+        schema_editor.execute(
+            "UPDATE api_product SET search_vector = "
+            "setweight(to_tsvector('english', coalesce(name, '')), 'A') || "
+            "setweight(to_tsvector('english', coalesce(tags, '')), 'B') || "
+            "setweight(to_tsvector('english', coalesce(fragrance, '')), 'B') || "
+            "setweight(to_tsvector('english', coalesce(color, '')), 'B') || "
+            "setweight(to_tsvector('english', coalesce(description, '')), 'C')"
+        )
+    elif vendor == "sqlite":
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            "name, description, tags, fragrance, color, "
+            "tokenize = 'porter unicode61')"
+        )
+        schema_editor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, name, description, tags, fragrance, color) "
+            "SELECT id, name, description, tags, fragrance, color FROM api_product"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        schema_editor.execute("DROP INDEX IF EXISTS api_product_search_vector_gin")
+    elif vendor == "sqlite":
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0011_offer_interval_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                blank=True, editable=False, null=True
+            ),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
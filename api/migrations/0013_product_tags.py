@@ -0,0 +1,67 @@
+# Generated by Django 5.1.1 on 2026-10-18 08:53
+
+from django.db import migrations, models
+
+
+def backfill_product_tags(apps, schema_editor):
+    Product = apps.get_model("api", "Product")
+    Tag = apps.get_model("api", "Tag")
+    ProductTag = Product.tag_set.through
+
+    product_tags = {}
+    for product_id, tags in Product.objects.values_list("id", "tags").iterator():
+        names = []
+        for name in (tags or "").split(","):
+            name = name.strip().lower()
+            if name and name not in names:
+                names.append(name)
+        if names:
+            product_tags[product_id] = names
+
+    all_names = {name for names in product_tags.values() for name in names}
+    Tag.objects.bulk_create(
+        [Tag(name=name) for name in all_names], ignore_conflicts=True, batch_size=1000
+    )
+    tag_ids = dict(Tag.objects.values_list("name", "id"))
+    ProductTag.objects.bulk_create(
+        [
+            ProductTag(product_id=product_id, tag_id=tag_ids[name])
+            for product_id, names in product_tags.items()
+            for name in names
+        ],
+        ignore_conflicts=True,
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0012_product_search"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Tag",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=255, unique=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="tag_set",
+            field=models.ManyToManyField(
+                blank=True, editable=False, related_name="products", to="api.tag"
+            ),
+        ),
+        migrations.RunPython(backfill_product_tags, migrations.RunPython.noop),
+    ]
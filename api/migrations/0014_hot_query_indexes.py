@@ -0,0 +1,64 @@
+# Generated by Django 5.1.1 on 2026-10-18 08:55
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0013_product_tags"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="cart",
+            index=models.Index(
+                condition=models.Q(("is_active", True)),
+                fields=["user"],
+                name="cart_user_active_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="cart",
+            index=models.Index(
+                fields=["user", "product", "variant"],
+                name="cart_user_product_variant_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(
+                fields=["order", "sender", "-created_at"],
+                name="message_order_sender_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="offer",
+            index=models.Index(
+                condition=models.Q(("is_active", True)),
+                fields=["end_date"],
+                name="offer_active_end_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                fields=["user", "-created_at"], name="order_user_created_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="review",
+            index=models.Index(
+                fields=["product", "approved", "-created_at"],
+                name="review_product_approved_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="review",
+            index=models.Index(
+                fields=["product", "-created_at"], name="review_product_created_idx"
+            ),
+        ),
+    ]
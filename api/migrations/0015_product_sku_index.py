@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 08:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0014_hot_query_indexes"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="product",
+            name="sku",
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+    ]
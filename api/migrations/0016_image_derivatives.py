@@ -0,0 +1,28 @@
+# Generated by Django 5.1.1 on 2026-10-18 09:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0015_product_sku_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="extendedusermodel",
+            name="profile_photo_derivatives",
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="image_derivatives",
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name="testimonial",
+            name="profile_image_derivatives",
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
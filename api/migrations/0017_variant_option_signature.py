@@ -0,0 +1,46 @@
+# Generated by Django 5.1.1 on 2026-10-18 09:03
+
+from django.db import migrations, models
+
+
+def backfill_option_signatures(apps, schema_editor):
+    VariantDetail = apps.get_model("api", "VariantDetail")
+    VariantOptionLink = VariantDetail.variant_options.through
+
+    options = {}
+    for variant_id, option_id in VariantOptionLink.objects.values_list(
+        "variantdetail_id", "variantoption_id"
+    ).iterator():
+        options.setdefault(variant_id, set()).add(option_id)
+
+    variants = list(VariantDetail.objects.only("id"))
+    for variant in variants:
+        variant.option_signature = ",".join(
+            str(option_id) for option_id in sorted(options.get(variant.id, ()))
+        )
+    VariantDetail.objects.bulk_update(variants, ["option_signature"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0016_image_derivatives"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="variantdetail",
+            name="option_signature",
+            field=models.CharField(
+                blank=True, default="", editable=False, max_length=255
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="variantdetail",
+            index=models.Index(
+                fields=["product", "option_signature"],
+                name="api_variant_product_68ad67_idx",
+            ),
+        ),
+        migrations.RunPython(backfill_option_signatures, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.1.1 on 2026-10-18 09:07
+
+import api.models
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_cart_items(apps, schema_editor):
+    """Folds repeated (user, product, variant) items into the oldest one, adding up quantities."""
+    Cart = apps.get_model("api", "Cart")
+    duplicates = (
+        Cart.objects.values("user_id", "product_id", "variant_id")
+        .annotate(count=Count("id"), keep_id=Min("id"), total=Sum("quantity"))
+        .filter(count__gt=1)
+    )
+    for duplicate in duplicates:
+        items = Cart.objects.filter(
+            user_id=duplicate["user_id"],
+            product_id=duplicate["product_id"],
+            variant_id=duplicate["variant_id"],
+        )
+        items.exclude(id=duplicate["keep_id"]).delete()
+        items.filter(id=duplicate["keep_id"]).update(quantity=duplicate["total"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0017_variant_option_signature"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="cart",
+            name="variant",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=api.models.detach_cart_variant,
+                related_name="cart_variant",
+                to="api.variantdetail",
+            ),
+        ),
+        migrations.RunPython(merge_duplicate_cart_items, migrations.RunPython.noop),
+    ]
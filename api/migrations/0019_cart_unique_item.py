@@ -0,0 +1,31 @@
+# Generated by Django 5.1.1 on 2026-10-18 09:07
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0018_merge_duplicate_cart_items"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name="cart",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("variant__isnull", False)),
+                fields=("user", "product", "variant"),
+                name="cart_unique_user_product_variant",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="cart",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("variant__isnull", True)),
+                fields=("user", "product"),
+                name="cart_unique_user_product",
+            ),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.1 on 2026-10-18 10:12
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def fill_missing_effective_prices(apps, schema_editor):
+    """
+    Only rows written around Product.save() can still lack a price; they get
+    their current_price and the next effective price refresh applies offers.
+    """
+    Product = apps.get_model("api", "Product")
+    Product.objects.filter(effective_price__isnull=True).update(
+        effective_price=F("current_price")
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0019_cart_unique_item"),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_missing_effective_prices, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="product",
+            name="effective_price",
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=10),
+        ),
+    ]
@@ -1,12 +1,15 @@
 
 import random
 from django.utils import timezone
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models import F, Q, Value
+from django.db.models.functions import Concat, Substr
 from django.contrib import admin
 from django.contrib.auth.models import User
 from decimal import Decimal
 from django.conf import settings
 from django.contrib.postgres.fields import JSONField 
+from django.contrib.postgres.search import SearchVectorField
 # Create your models here.
 
 class Category(models.Model):
@@ -21,39 +24,132 @@ class Category(models.Model):
     description = models.TextField(blank=True, null=True)
     is_active = models.BooleanField(default=True)
 
+    # Materialized path of the node, e.g. '/1/5/12/'. Kept up to date in save()
+    # so ancestor, descendant and subtree lookups are single indexed queries.
+    path = models.CharField(max_length=255, blank=True, default='', editable=False, db_index=True)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+    # True when the category and every one of its ancestors is active.
+    is_visible = models.BooleanField(default=True, editable=False, db_index=True)
+
     def __str__(self):
         return f"{self.id} - {self.name}"
 
+    @transaction.atomic
+    def save(self, *args, **kwargs):
+        # The row, its path and the subtree rewrite commit together or not at all
+        old_path, old_visible = self.path, self.is_visible
+        parent = self.parent
+        if parent and old_path and parent.path.startswith(old_path):
+            raise ValueError("A category cannot be moved below itself or its subcategories.")
+        self.depth = parent.depth + 1 if parent else 0
+        self.is_visible = self.is_active and (parent.is_visible if parent else True)
+        super().save(*args, **kwargs)
+
+        path = self.build_path(parent.path if parent else '', self.pk)
+        self.moved = bool(old_path) and path != old_path
+        if path != old_path or self.is_visible != old_visible:
+            self.path = path
+            Category.objects.filter(pk=self.pk).update(
+                path=self.path, depth=self.depth, is_visible=self.is_visible
+            )
+            if old_path:
+                self._rebuild_subtree(old_path)
+
+    @staticmethod
+    def build_path(parent_path, pk):
+        return f"{parent_path or '/'}{pk}/"
+
+    @staticmethod
+    def subtree_q(path, field='path'):
+        """
+        Matches the rows whose materialized path `field` starts with path.
+        SQLite compiles startswith to a case-insensitive LIKE that never uses
+        the index, so there it becomes the equivalent range ('0' follows '/').
+        Postgres keeps LIKE, served by the pattern_ops index Django adds, as
+        its locale collation doesn't order paths byte by byte.
+        """
+        if connection.vendor == 'sqlite':
+            return Q(**{f'{field}__gte': path, f'{field}__lt': path[:-1] + '0'})
+        return Q(**{f'{field}__startswith': path})
+
+    def _rebuild_subtree(self, old_path):
+        """
+        Moves the descendants stored under old_path below the current path
+        and recomputes their depth and visibility.
+        """
+        descendants = Category.objects.filter(self.subtree_q(old_path)).exclude(pk=self.pk)
+        if old_path != self.path:
+            descendants.update(
+                path=Concat(Value(self.path), Substr('path', len(old_path) + 1)),
+                depth=F('depth') + (self.depth - old_path.count('/') + 2),
+            )
+
+        descendants = Category.objects.filter(self.subtree_q(self.path)).exclude(pk=self.pk)
+        if not self.is_visible:
+            descendants.update(is_visible=False)
+            return
+
+        descendants.update(is_visible=F('is_active'))
+        hidden = Q()
+        for path in descendants.filter(is_active=False).values_list('path', flat=True):
+            hidden |= self.subtree_q(path)
+        if hidden:
+            descendants.filter(hidden).update(is_visible=False)
+
     def get_subcategories(self):
         return self.subcategories.filter(is_active=True)
 
+    def get_ancestor_ids(self):
+        """
+        Returns the ids of all parent categories, nearest first, read from the path.
+        """
+        return [int(pk) for pk in reversed(self.path.strip('/').split('/')[:-1])]
+
     def get_ancestors(self):
         """
         Returns a list of all parent categories up to the root.
         """
-        categories = []
-        current_category = self
-        while current_category.parent is not None:
-            categories.append(current_category.parent)
-            current_category = current_category.parent
-        return categories
+        ancestor_ids = self.get_ancestor_ids()
+        if not ancestor_ids:
+            return []
+        return list(Category.objects.filter(id__in=ancestor_ids).order_by('-depth'))
 
     def get_descendants(self):
         """
         Returns a list of all subcategories down to the leaf nodes.
+        Branches below an inactive subcategory are left out.
         """
         descendants = []
-        for subcategory in self.get_subcategories():
-            descendants.append(subcategory)
-            descendants.extend(subcategory.get_descendants())
+        hidden_paths = []
+        for category in self.get_subtree().exclude(pk=self.pk).order_by('path'):
+            if any(category.path.startswith(path) for path in hidden_paths):
+                continue
+            if not category.is_active:
+                hidden_paths.append(category.path)
+                continue
+            descendants.append(category)
         return descendants
 
+    def get_subtree(self):
+        """
+        Returns a queryset of this category and everything below it.
+        """
+        return Category.objects.filter(self.subtree_q(self.path))
+
+
+class Tag(models.Model):
+    # Lowercased, trimmed entry of Product.tags, see tag_utils.parse_tags()
+    name = models.CharField(max_length=255, unique=True)
+
+    def __str__(self):
+        return self.name
+
 
 class Product(models.Model):
     name = models.CharField(max_length=255)
     description = models.TextField()
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='products')
-    sku = models.CharField(max_length=100)
+    sku = models.CharField(max_length=100, db_index=True)  # Catalog imports upsert by sku
     original_price = models.DecimalField(max_digits=10, decimal_places=2)
     current_price = models.DecimalField(max_digits=10, decimal_places=2)
     size = models.CharField(max_length=50)  # e.g., LxBxH or volume
@@ -64,46 +160,67 @@ class Product(models.Model):
     in_the_box = models.TextField()  # e.g., '5 pcs Nilofer floating candles'
     stock = models.PositiveIntegerField()
     tags = models.CharField(max_length=255, blank=True)  # For additional filtering or metadata
+    # Normalized copy of tags for indexed filtering, kept in sync by tag_utils.sync_product_tags()
+    tag_set = models.ManyToManyField(Tag, related_name='products', blank=True, editable=False)
     image_url = models.URLField(blank=True, null=True)
+    # Resized copies of image_url, filled in by tasks.generate_image_derivatives_task
+    image_derivatives = models.JSONField(default=dict, blank=True, editable=False)
+    # current_price after the active offer, kept up to date by pricing_utils.refresh_effective_prices().
+    # Not nullable: it is a keyset pagination column, where NULLs have no defined position
+    effective_price = models.DecimalField(max_digits=10, decimal_places=2, editable=False)
+    # Weighted full-text document on Postgres, kept up to date by search_utils.update_search_index()
+    search_vector = SearchVectorField(null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['effective_price', 'id']),
+        ]
     
     def __str__(self):
         return self.name
 
+    # Fields effective_price is computed from
+    PRICING_FIELDS = ('current_price', 'category_id')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remembered so save() only reprices when one of them actually changed
+        instance._loaded_pricing = instance._pricing_state()
+        # Likewise for the tag_set sync in signals.sync_product_tags_signal
+        instance._loaded_tags = instance.__dict__.get('tags')
+        return instance
+
+    def _pricing_state(self):
+        return {field: self.__dict__[field] for field in self.PRICING_FIELDS if field in self.__dict__}
+
+    def save(self, *args, **kwargs):
+        from .pricing_utils import OfferResolver, refresh_effective_prices
+
+        adding = self._state.adding
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and not {'current_price', 'category', 'category_id'} & set(update_fields):
+            super().save(*args, **kwargs)
+            return
+
+        self.effective_price = OfferResolver().get_effective_price(self.id, self.category_id, self.current_price)
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'effective_price'}
+        repriced = self._pricing_state() != getattr(self, '_loaded_pricing', None)
+        super().save(*args, **kwargs)
+        if not adding and repriced:
+            # A new category can change which offer the variants get
+            refresh_effective_prices(product_ids=[self.pk])
+        self._loaded_pricing = self._pricing_state()
+
     def get_price_with_offer(self):
         """
         Returns the product price after applying any active offer.
         If a variant exists, the variant price will be used.
         """
-        now = timezone.now()
-
-        # Check if there is an active product-specific offer
-        product_offer = Offer.objects.filter(
-            product=self, 
-            is_active=True,
-            start_date__lte=now,
-            end_date__gte=now
-        ).first()
-
-        if product_offer:
-            # Apply product-level offer
-            return product_offer.apply_discount(self.current_price)
-
-        # Check if there's a category-level offer if no product offer exists
-        category_offer = Offer.objects.filter(
-            category=self.category,
-            is_active=True,
-            start_date__lte=now,
-            end_date__gte=now
-        ).first()
-
-        if category_offer:
-            # Apply category-level offer
-            return category_offer.apply_discount(self.current_price)
-
-        # No offers available, return the original product price
-        return self.current_price
-
+        from .pricing_utils import OfferResolver
 
+        return OfferResolver().get_price(self)
 
 
 class ExtendedUserModel(models.Model):
@@ -126,6 +243,7 @@ class ExtendedUserModel(models.Model):
     user = models.OneToOneField(User,on_delete=models.CASCADE,related_name='extendedusermodel',blank=True,null=True)
     phone = models.CharField(max_length=20,blank=True,null=True)
     profile_photo = models.ImageField(upload_to='profile_photos', blank=True, null=True)
+    profile_photo_derivatives = models.JSONField(default=dict, blank=True, editable=False)
     gender = models.CharField(max_length=1, choices=GENDER_CHOICES, blank=True, null=True)
     dob = models.DateField(blank=True, null=True)
     user_type = models.CharField(max_length=10, choices=USER_TYPE_CHOICES, default='user')  
@@ -166,43 +284,40 @@ class VariantDetail(models.Model):
     current_price = models.DecimalField(max_digits=10, decimal_places=2)
     stock = models.PositiveIntegerField(default=0)
     variant_data = models.JSONField(null=True, blank=True)  # Storing variants dynamically as key-value pairs
+    effective_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, editable=False)
+    # Sorted variant_options ids, e.g. '3,7,12', kept in sync by signals.sync_option_signature_signal
+    option_signature = models.CharField(max_length=255, blank=True, default='', editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'option_signature']),
+        ]
+
     def __str__(self):
         variants = ', '.join([f"{key}: {value}" for key, value in self.variant_data.items()])
         return f"{self.product.name} - {variants}"
-    
+
+    @staticmethod
+    def build_option_signature(option_ids):
+        """Canonical form of a set of option ids, whatever their order or repeats."""
+        return ','.join(str(option_id) for option_id in sorted({int(option_id) for option_id in option_ids}))
+
+    def save(self, *args, **kwargs):
+        from .pricing_utils import OfferResolver
+
+        self.effective_price = OfferResolver().get_effective_price(
+            self.product_id, self.product.category_id, self.current_price
+        )
+        super().save(*args, **kwargs)
+
     def get_variant_price_with_offer(self):
         """
         Returns the variant price after applying any active offer.
         Offers can apply to either the product or the category.
         """
-        now = timezone.now()
+        from .pricing_utils import OfferResolver
 
-        # Check if there's a product-specific offer
-        product_offer = Offer.objects.filter(
-            product=self.product,
-            is_active=True,
-            start_date__lte=now,
-            end_date__gte=now
-        ).first()
-
-        if product_offer:
-            # Apply product-level offer
-            return product_offer.apply_discount(self.current_price)
-
-        # Check for category-level offer if no product offer exists
-        category_offer = Offer.objects.filter(
-            category=self.product.category,
-            is_active=True,
-            start_date__lte=now,
-            end_date__gte=now
-        ).first()
-
-        if category_offer:
-            # Apply category-level offer
-            return category_offer.apply_discount(self.current_price)
-
-        # No offers available, return the original variant price
-        return self.current_price
+        return OfferResolver().get_variant_price(self)
 
     def __str__(self):
         variants = ', '.join([f"{opt.variant_type.name}: {opt.option_value}" for opt in self.variant_options.all()])
@@ -221,15 +336,66 @@ class Wishlist(models.Model):
         return f"{self.user.username}'s Wishlist - {self.product.name}"
     
 
+def detach_cart_variant(collector, field, sub_objs, using):
+    """
+    on_delete for Cart.variant. Like SET_NULL, but a user can hold a product
+    without a variant only once, so items that would end up on the same
+    product are merged: the quantities are added to one item, the others are
+    deleted along with the variant.
+    """
+    deleted = list(Cart.objects.using(using).filter(pk__in=[item.pk for item in sub_objs]).order_by('id'))
+    merged = {
+        (item.user_id, item.product_id): [item, item.quantity]
+        for item in Cart.objects.using(using).filter(
+            variant__isnull=True,
+            user_id__in={item.user_id for item in deleted},
+            product_id__in={item.product_id for item in deleted},
+        )
+    }
+    detached = []
+    for item in deleted:
+        key = (item.user_id, item.product_id)
+        if key in merged:
+            merged[key][1] += item.quantity
+            collector.collect([item], source=field.remote_field.model, source_attr=field.name, nullable=True)
+        else:
+            merged[key] = [item, item.quantity]
+            detached.append(item)
+    if detached:
+        collector.add_field_update(field, None, detached)
+    quantity_field = Cart._meta.get_field('quantity')
+    for item, quantity in merged.values():
+        if quantity != item.quantity:
+            collector.add_field_update(quantity_field, quantity, [item])
+
+
 class Cart(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='carts')
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='cart_products')
-    variant = models.ForeignKey(VariantDetail, on_delete=models.SET_NULL, blank=True, null=True, related_name='cart_variant')
+    variant = models.ForeignKey(VariantDetail, on_delete=detach_cart_variant, blank=True, null=True, related_name='cart_variant')
     quantity = models.PositiveIntegerField(default=1)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)  # To track active cart items
 
+    class Meta:
+        indexes = [
+            # The cart page and checkout only read active items
+            models.Index(fields=['user'], condition=Q(is_active=True), name='cart_user_active_idx'),
+            # Add/update/remove look items up by user, product and variant
+            models.Index(fields=['user', 'product', 'variant'], name='cart_user_product_variant_idx'),
+        ]
+        constraints = [
+            # NULLs never conflict in a unique index, so items without a variant need their own
+            models.UniqueConstraint(
+                fields=['user', 'product', 'variant'], condition=Q(variant__isnull=False),
+                name='cart_unique_user_product_variant',
+            ),
+            models.UniqueConstraint(
+                fields=['user', 'product'], condition=Q(variant__isnull=True), name='cart_unique_user_product',
+            ),
+        ]
+
     def __str__(self):
         return f"{self.user.user.username}'s cart - {self.product.name} ({self.quantity})"
 
@@ -267,6 +433,12 @@ class Order(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     remark = models.TextField(blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            # A user's order history, newest first
+            models.Index(fields=['user', '-created_at'], name='order_user_created_idx'),
+        ]
+
     def __str__(self):
         return f"Order {self.order_number} - {self.user.username}"
 
@@ -316,9 +488,23 @@ class Offer(models.Model):
 
     is_active = models.BooleanField(default=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'is_active', 'start_date', 'end_date']),
+            models.Index(fields=['category', 'is_active', 'start_date', 'end_date']),
+            # Offers the active offer index loads: active and not yet ended
+            models.Index(fields=['end_date'], condition=Q(is_active=True), name='offer_active_end_idx'),
+        ]
+
     def __str__(self):
         return f"{self.name} - {self.get_offer_type_display()}"
 
+    def get_target(self):
+        """Returns the (offer_type, id) pair this offer competes on."""
+        if self.offer_type == 'product':
+            return ('product', self.product_id)
+        return ('category', self.category_id)
+
     def is_valid(self):
         """Checks if the offer is within the valid time frame."""
         now = timezone.now()
@@ -405,12 +591,19 @@ class Review(models.Model):
 
     class Meta:
         ordering = ['-created_at']  # Order reviews by latest first
+        indexes = [
+            # Approved (public) and pending (moderation) listings
+            models.Index(fields=['product', 'approved', '-created_at'], name='review_product_approved_idx'),
+            # Every review of a product, newest first
+            models.Index(fields=['product', '-created_at'], name='review_product_created_idx'),
+        ]
 
 
 
 class Testimonial(models.Model):
     name = models.CharField(max_length=20)
     profile_image = models.ImageField(upload_to='testimonials/', null=True, blank=True)
+    profile_image_derivatives = models.JSONField(default=dict, blank=True, editable=False)
     testimonial_text = models.TextField()  # The content of the testimonial
     rating = models.PositiveIntegerField(null=True, blank=True)  # Optional rating, e.g., 1 to 5 stars
     created_at = models.DateTimeField(auto_now_add=True)  # Automatically set the date when created
@@ -436,5 +629,10 @@ class Message(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     user_type = models.CharField(max_length=10, choices=USER_TYPE_CHOICES, default='user')
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['order', 'sender', '-created_at'], name='message_order_sender_idx'),
+        ]
+
     def __str__(self):
         return f"Message from {self.sender.username} for Order {self.order.order_number}: {self.content[:50]}"
\ No newline at end of file
@@ -1,6 +1,150 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import json
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class ProductCursorPagination(BasePagination):
+    """
+    Keyset pagination over the queryset's own ordering, e.g. (id) or
+    (effective_price, id). The cursor holds the ordering values of the row at
+    the page edge, so every page is a single indexed range scan whatever its
+    depth. The total count is only computed when asked for.
+    """
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    count_query_param = 'with_count'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering = tuple(queryset.query.order_by) or ('id',)
+        self.model = queryset.model
+        self.count = queryset.count() if request.query_params.get(self.count_query_param) in ('1', 'true') else None
+
+        position, reverse = self.decode_cursor(request)
+        ordering = self._reverse_ordering() if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self._after(ordering, position))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def _reverse_ordering(self):
+        return tuple(field[1:] if field.startswith('-') else f'-{field}' for field in self.ordering)
+
+    @staticmethod
+    def _after(ordering, position):
+        """Builds the lexicographic 'comes after position' filter for ordering."""
+        condition = Q()
+        equal = {}
+        for field, value in zip(ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    def _position(self, instance):
+        return [str(getattr(instance, field.lstrip('-'))) for field in self.ordering]
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            position, reverse = cursor['p'], bool(cursor.get('r'))
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        # Values go into range filters, so each must be a valid, non-null value of its column
+        try:
+            position = [
+                self.model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, position)
+            ]
+        except (FieldDoesNotExist, ValidationError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if any(value is None for value in position):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def encode_cursor(self, instance, reverse=False):
+        cursor = {'p': self._position(instance)}
+        if reverse:
+            cursor['r'] = 1
+        encoded = base64.urlsafe_b64encode(json.dumps(cursor).encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1])
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        response = {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        }
+        if self.count is not None:
+            response = {'count': self.count, **response}
+        return Response(response)
+
 
 class ProductPagination(PageNumberPagination):
     page_size = 10  # Set default to 10
     page_size_query_param = 'page_size'  # Allow clients to adjust page size (optional)
-    max_page_size = 100  # Maximum page size limit
\ No newline at end of file
+    max_page_size = 100  # Maximum page size limit
+    cursor_paginator = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # ?pagination=cursor (or a cursor from a previous page) switches to keyset pages
+        if ProductCursorPagination.cursor_query_param in request.query_params or request.query_params.get('pagination') == 'cursor':
+            self.cursor_paginator = ProductCursorPagination()
+            return self.cursor_paginator.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class ProductSearchPagination(PageNumberPagination):
+    """Page numbers over the ranked list of search matches."""
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
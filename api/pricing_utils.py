@@ -0,0 +1,349 @@
+import threading
+from collections import namedtuple
+from datetime import timedelta
+from decimal import Decimal, ROUND_HALF_UP
+from types import MappingProxyType
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, F, Q, Sum, Value, When
+from django.db.models.functions import Abs, Coalesce, Greatest, Round
+from django.utils import timezone
+from .cache_utils import get_cache_version, bump_cache_version, invalidate_product_cache
+from .models import Category, Offer, Product, VariantDetail
+
+OFFER_INDEX_VERSION_KEY = 'offer_index:version'
+EFFECTIVE_PRICE_BATCH_SIZE = 1000
+
+
+class OfferIndexSnapshot(namedtuple('OfferIndexSnapshot', (
+    'version', 'next_change', 'product_offers', 'category_offers', 'category_chains',
+))):
+    """
+    Immutable view of the current and upcoming active offers, keyed by
+    product id and category id, together with the ancestry of every category
+    read from its materialized path. Lookups still compare the offer dates
+    against the current time, so an offer never applies past end_date even
+    between rebuilds.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def build(cls, now, version):
+        product_offers = {}
+        category_offers = {}
+        boundaries = []
+        for offer in Offer.objects.filter(is_active=True, end_date__gte=now).order_by('id'):
+            if offer.product_id is not None:
+                product_offers.setdefault(offer.product_id, []).append(offer)
+            if offer.category_id is not None:
+                category_offers.setdefault(offer.category_id, []).append(offer)
+            # An offer still applies at end_date itself and stops right after it
+            end = offer.end_date + timedelta(microseconds=1)
+            boundaries.extend(boundary for boundary in (offer.start_date, end) if boundary > now)
+
+        category_chains = {}
+        for category_id, path in Category.objects.values_list('id', 'path'):
+            # '/1/5/12/' -> (12, 5, 1): the category itself, then its ancestors nearest first
+            category_chains[category_id] = tuple(int(pk) for pk in reversed(path.strip('/').split('/')) if pk)
+
+        return cls(
+            version=version,
+            next_change=min(boundaries, default=None),
+            product_offers=MappingProxyType({key: tuple(offers) for key, offers in product_offers.items()}),
+            category_offers=MappingProxyType({key: tuple(offers) for key, offers in category_offers.items()}),
+            category_chains=MappingProxyType(category_chains),
+        )
+
+    def is_stale(self, now, version):
+        return version != self.version or (self.next_change is not None and now >= self.next_change)
+
+    @staticmethod
+    def _first_active(offers, now):
+        for offer in offers:
+            if offer.start_date <= now <= offer.end_date:
+                return offer
+        return None
+
+    def get_offer(self, product_id, category_id, now):
+        """
+        Returns the offer applying to a product: its own offer first, then
+        one on its category, then one on the nearest ancestor category that
+        has any. The oldest offer wins among candidates at the same level.
+        """
+        offer = self._first_active(self.product_offers.get(product_id, ()), now)
+        if offer:
+            return offer
+        for ancestor_id in self.category_chains.get(category_id, (category_id,)):
+            offer = self._first_active(self.category_offers.get(ancestor_id, ()), now)
+            if offer:
+                return offer
+        return None
+
+
+class ActiveOfferIndex:
+    """
+    Process-local holder of the current OfferIndexSnapshot.
+
+    The snapshot is rebuilt when an Offer or Category is saved or deleted
+    anywhere (tracked through a shared cache version) and when it reaches
+    `next_change`, the earliest upcoming start_date or end_date. Readers
+    don't take the lock: a rebuild publishes the new snapshot with a single
+    reference assignment, so a reader sees either the old snapshot or the
+    new one, never a mix of both.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = OfferIndexSnapshot(None, None, MappingProxyType({}), MappingProxyType({}), MappingProxyType({}))
+
+    def refresh(self, now=None):
+        """Returns a snapshot that is current at `now`, rebuilding it if needed."""
+        now = now or timezone.now()
+        version = get_cache_version(OFFER_INDEX_VERSION_KEY)
+        snapshot = self._snapshot
+        if snapshot.is_stale(now, version):
+            with self._lock:
+                snapshot = self._snapshot
+                if snapshot.is_stale(now, version):
+                    snapshot = self._snapshot = OfferIndexSnapshot.build(now, version)
+        return snapshot
+
+    def invalidate(self):
+        self._snapshot = self._snapshot._replace(version=None)
+
+
+active_offer_index = ActiveOfferIndex()
+
+
+def invalidate_offer_index():
+    active_offer_index.invalidate()
+    bump_cache_version(OFFER_INDEX_VERSION_KEY)
+
+
+class OfferResolver:
+    """
+    Prices products and variants against the active offer index at a fixed
+    instant, so a whole page is priced consistently without SQL.
+    """
+
+    def __init__(self, now=None):
+        self.now = now or timezone.now()
+        self.index = active_offer_index.refresh(self.now)
+
+    def get_offer(self, product_id, category_id):
+        return self.index.get_offer(product_id, category_id, self.now)
+
+    def get_price(self, product):
+        offer = self.get_offer(product.id, product.category_id)
+        return offer.apply_discount(product.current_price) if offer else product.current_price
+
+    def get_variant_price(self, variant):
+        offer = self.get_offer(variant.product_id, variant.product.category_id)
+        return offer.apply_discount(variant.current_price) if offer else variant.current_price
+
+    def get_effective_price(self, product_id, category_id, price):
+        """Returns price after the applying offer, rounded to cents for storage."""
+        offer = self.get_offer(product_id, category_id)
+        if offer:
+            price = offer.apply_discount(price)
+        return Decimal(price).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+def get_offer_resolver(context):
+    """Returns the resolver shared through a serializer context, creating it on first use."""
+    resolver = context.get('offer_resolver')
+    if resolver is None:
+        resolver = OfferResolver()
+        context['offer_resolver'] = resolver
+    return resolver
+
+
+def _refresh_in_batches(queryset, model, get_category_id, resolver):
+    """
+    Walks queryset in primary key order and bulk updates the rows whose
+    effective_price is out of date. Returns the number of updated rows.
+    """
+    updated = 0
+    last_pk = 0
+    while True:
+        batch = list(queryset.filter(pk__gt=last_pk).order_by('pk')[:EFFECTIVE_PRICE_BATCH_SIZE])
+        if not batch:
+            return updated
+        changed = []
+        for obj in batch:
+            price = resolver.get_effective_price(obj.product_id, get_category_id(obj), obj.current_price)
+            if obj.effective_price != price:
+                obj.effective_price = price
+                changed.append(obj)
+        if changed:
+            model.objects.bulk_update(changed, ['effective_price'])
+            invalidate_product_cache({obj.product_id for obj in changed})
+        updated += len(changed)
+        last_pk = batch[-1].pk
+
+
+def refresh_effective_prices(product_ids=None, category_ids=None):
+    """
+    Recomputes the stored effective_price of products and their variants.
+    With no arguments the whole catalog is refreshed; otherwise only the
+    given products and the products anywhere below the given categories.
+    """
+    products = Product.objects.all()
+    if product_ids is not None or category_ids is not None:
+        # A category offer reaches the products of the whole subtree
+        selection = Q(id__in=product_ids or [])
+        for path in Category.objects.filter(id__in=category_ids or []).values_list('path', flat=True):
+            selection |= Q(category_id__in=Category.objects.filter(Category.subtree_q(path)).values('id'))
+        products = products.filter(selection)
+
+    resolver = OfferResolver()
+    updated = _refresh_in_batches(
+        products.annotate(product_id=F('id')).only('id', 'category_id', 'current_price', 'effective_price'),
+        Product,
+        lambda product: product.category_id,
+        resolver,
+    )
+    updated += _refresh_in_batches(
+        VariantDetail.objects.filter(product__in=products.values('id'))
+        .annotate(category_id=F('product__category_id'))
+        .only('id', 'product_id', 'current_price', 'effective_price'),
+        VariantDetail,
+        lambda variant: variant.category_id,
+        resolver,
+    )
+    return updated
+
+
+def queue_effective_price_refresh(eta=None, **kwargs):
+    """
+    Queues refresh_effective_prices_task. A broker outage must not fail the
+    caller's request; the periodic full refresh catches up on lost jobs.
+    """
+    from .tasks import refresh_effective_prices_task
+
+    try:
+        refresh_effective_prices_task.apply_async(kwargs=kwargs, eta=eta)
+    except Exception as e:
+        print(f"Error scheduling effective price refresh {kwargs}: {e}")
+
+
+def schedule_effective_price_refresh(offers):
+    """
+    Refreshes the prices an offer touches now and queues the refreshes for
+    its start and end. `offers` is a list of (product_id, category_id,
+    start_date, end_date) tuples.
+    """
+    now = timezone.now()
+    for product_id, category_id, start_date, end_date in offers:
+        kwargs = {
+            'product_ids': [product_id] if product_id else [],
+            'category_ids': [category_id] if category_id else [],
+        }
+        queue_effective_price_refresh(**kwargs)
+        # The offer still applies at end_date itself, so recompute just after it
+        for boundary in (start_date, end_date + timedelta(seconds=1)):
+            if boundary > now:
+                queue_effective_price_refresh(eta=boundary, **kwargs)
+
+
+def _simulated_discount(price, discount):
+    # SQLite stores 90.00 as the integer 90, so dividing there would truncate:
+    # the percentage becomes a multiplier here and the database only multiplies
+    ratio = DecimalField(max_digits=12, decimal_places=6)
+    if discount['discount_type'] == 'percentage':
+        factor = (Decimal('100') - discount['discount_value']) / Decimal('100')
+        return Round(price * Value(factor, output_field=ratio), 2)
+    amount = Value(discount['discount_value'], output_field=ratio)
+    return Greatest(price - amount, Value(Decimal('0'), output_field=ratio))
+
+
+def _simulation_rules(discounts, prefix):
+    """
+    Orders the simulated discounts by precedence, SKU lists first and then
+    categories nearest to the product first, as ActiveOfferIndex does.
+    """
+    sku_rules = [discount for discount in discounts if discount.get('skus')]
+    category_rules = sorted(
+        (discount for discount in discounts if discount.get('category')),
+        key=lambda discount: -discount['category'].depth,
+    )
+    rules = []
+    for discount in sku_rules:
+        rules.append((Q(**{f'{prefix}sku__in': discount['skus']}), discount))
+    for discount in category_rules:
+        subtree = Category.objects.filter(Category.subtree_q(discount['category'].path)).values('id')
+        rules.append((Q(**{f'{prefix}category_id__in': subtree}), discount))
+    return rules
+
+
+def _simulate_queryset(queryset, discounts, prefix):
+    rules = _simulation_rules(discounts, prefix)
+    matched = Q()
+    for condition, _ in rules:
+        matched |= condition
+    price = F('current_price')
+    money = DecimalField(max_digits=12, decimal_places=2)
+    return queryset.filter(matched).annotate(
+        baseline_price=Coalesce('effective_price', 'current_price'),
+        simulated_price=Case(
+            *[When(condition, then=_simulated_discount(price, discount)) for condition, discount in rules],
+            default=price,
+            output_field=money,
+        ),
+        change=F('simulated_price') - F('baseline_price'),
+    )
+
+
+def _simulation_totals(queryset):
+    money = DecimalField(max_digits=14, decimal_places=2)
+    totals = queryset.aggregate(
+        skus=Count('id'),
+        baseline_total=Sum('baseline_price', output_field=money),
+        simulated_total=Sum('simulated_price', output_field=money),
+        total_change=Sum('change', output_field=money),
+        stock_weighted_change=Sum(F('change') * F('stock'), output_field=money),
+    )
+    for key, value in totals.items():
+        if key != 'skus':
+            totals[key] = _cents(value or 0)
+    return totals
+
+
+def _cents(amount):
+    return Decimal(amount).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+def simulate_offers(discounts, top=20):
+    """
+    Previews a set of discounts over the whole catalog without creating offers.
+    `discounts` are dicts with discount_type, discount_value and either a
+    `category` (applied to its subtree) or a list of `skus`. The simulated
+    discounts replace existing offers on the products they match.
+
+    Prices are computed by the database in a handful of set-based queries:
+    totals for products and variants plus the largest price changes.
+    """
+    products = _simulate_queryset(Product.objects.all(), discounts, '')
+    variants = _simulate_queryset(VariantDetail.objects.all(), discounts, 'product__')
+
+    top_changes = [
+        {'type': 'product', 'id': row['id'], 'product_id': row['id'], 'sku': row['sku'], 'name': row['name'],
+         'baseline_price': row['baseline_price'], 'simulated_price': row['simulated_price'], 'change': row['change']}
+        for row in products.order_by(Abs('change').desc(), 'id').values(
+            'id', 'sku', 'name', 'baseline_price', 'simulated_price', 'change')[:top]
+    ] + [
+        {'type': 'variant', 'id': row['id'], 'product_id': row['product_id'], 'sku': row['product__sku'],
+         'name': row['product__name'], 'baseline_price': row['baseline_price'],
+         'simulated_price': row['simulated_price'], 'change': row['change']}
+        for row in variants.order_by(Abs('change').desc(), 'id').values(
+            'id', 'product_id', 'product__sku', 'product__name', 'baseline_price', 'simulated_price', 'change')[:top]
+    ]
+    for row in top_changes:
+        for key in ('baseline_price', 'simulated_price', 'change'):
+            row[key] = _cents(row[key])
+    top_changes.sort(key=lambda row: (-abs(row['change']), row['type'], row['id']))
+
+    return {
+        'products': _simulation_totals(products),
+        'variants': _simulation_totals(variants),
+        'top_changes': top_changes[:top],
+    }
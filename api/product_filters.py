@@ -0,0 +1,226 @@
+import hashlib
+import json
+from decimal import Decimal, InvalidOperation
+from django.core.cache import cache
+from django.db.models import Case, Count, Prefetch, Value, When
+from .cache_utils import PRODUCT_FACETS_VERSION_KEY, get_cache_version
+from .models import Product, VariantDetail, VariantOption
+from .tag_utils import filter_by_tags
+
+# Compact representation used by the list endpoints unless ?fields= asks otherwise
+PRODUCT_LIST_FIELDS = (
+    'id', 'name', 'category', 'sku', 'original_price', 'current_price',
+    'price_with_offer', 'effective_price', 'image_url', 'image_urls',
+)
+# Columns the serializer and the cursor pagination need whatever is requested
+PRODUCT_REQUIRED_COLUMNS = ('id', 'category', 'current_price', 'effective_price')
+# Serializer fields rendered from a differently named column
+PRODUCT_FIELD_COLUMNS = {'image_urls': 'image_derivatives'}
+
+PRODUCT_ORDERINGS = {
+    'id': ('id',),
+    '-id': ('-id',),
+    'price': ('effective_price', 'id'),
+    '-price': ('-effective_price', '-id'),
+}
+
+# Facet name -> Product column; each accepts ?<facet>=a,b
+FACET_FIELDS = {
+    'color': 'color',
+    'fragrance': 'fragrance',
+    'burning_time': 'burning_time',
+    'category': 'category_id',
+}
+# Upper bounds of the price facet buckets, the last bucket is open ended
+PRICE_FACET_EDGES = (250, 500, 1000, 2000, 5000)
+PRODUCT_FACETS_TIMEOUT = 60 * 15
+
+
+def requested_product_fields(params, default=None):
+    """
+    Returns the ProductSerializer fields asked for with ?fields=a,b and
+    ?expand=variants, falling back to default. None means every field.
+    """
+    if params.get('fields'):
+        fields = {name.strip() for name in params['fields'].split(',') if name.strip()}
+    elif default is None:
+        return None
+    else:
+        fields = set(default)
+    if 'variants' in params.get('expand', '').split(','):
+        fields.add('variants')
+    return fields
+
+
+def with_product_details(queryset, fields=None):
+    """
+    Loads what ProductSerializer renders alongside the products: the category
+    in the same query, then all variants and their option ids in one query
+    each, so a page costs the same number of queries whatever its size.
+    With a set of fields, unrequested columns are deferred and variants are
+    only fetched when asked for.
+    """
+    queryset = queryset.select_related('category')
+    if fields is None:
+        queryset = queryset.defer('search_vector')  # Never rendered
+    else:
+        columns = {field.name for field in Product._meta.concrete_fields} & set(fields)
+        columns.update(PRODUCT_FIELD_COLUMNS[field] for field in fields if field in PRODUCT_FIELD_COLUMNS)
+        queryset = queryset.only(*columns.union(PRODUCT_REQUIRED_COLUMNS))
+        if 'variants' not in fields:
+            return queryset
+    return queryset.prefetch_related(
+        Prefetch(
+            'variants',
+            queryset=VariantDetail.objects.order_by('id').prefetch_related(
+                Prefetch('variant_options', queryset=VariantOption.objects.only('id'))
+            ),
+        )
+    )
+
+
+def _decimal_param(params, name):
+    try:
+        return Decimal(params[name])
+    except (KeyError, InvalidOperation):
+        return None
+
+
+def _list_param(params, name):
+    """Comma separated values, e.g. ?color=red,blue."""
+    return {value.strip() for value in params.get(name, '').split(',') if value.strip()}
+
+
+def selected_facet_values(params):
+    """Returns {facet: set of selected values} for every facet with a selection."""
+    selected = {}
+    for facet in FACET_FIELDS:
+        values = _list_param(params, facet)
+        if facet == 'category':
+            values = {int(value) for value in values if value.isdigit()}
+        if values:
+            selected[facet] = values
+    return selected
+
+
+def filter_product_scope(queryset, params):
+    """The filters that are not facets: price range and tags."""
+    min_price = _decimal_param(params, 'min_price')
+    if min_price is not None:
+        queryset = queryset.filter(effective_price__gte=min_price)
+    max_price = _decimal_param(params, 'max_price')
+    if max_price is not None:
+        queryset = queryset.filter(effective_price__lte=max_price)
+    # ?tags=a,b matches any of the tags, with ?tags_mode=all every one of them
+    tags = _list_param(params, 'tags')
+    if tags:
+        queryset = filter_by_tags(queryset, tags, match_all=params.get('tags_mode') == 'all')
+    return queryset
+
+
+def filter_products(queryset, params):
+    """
+    Applies the catalog query parameters to a Product queryset.
+    Prices refer to the stored effective_price, i.e. what customers pay.
+    Facets match any of their selected values and all facets must match.
+    """
+    queryset = filter_product_scope(queryset, params)
+    for facet, values in selected_facet_values(params).items():
+        queryset = queryset.filter(**{f'{FACET_FIELDS[facet]}__in': values})
+
+    ordering = PRODUCT_ORDERINGS.get(params.get('ordering'), PRODUCT_ORDERINGS['id'])
+    return queryset.order_by(*ordering)
+
+
+def _price_bucket_expression():
+    whens = [When(effective_price__lt=edge, then=Value(index)) for index, edge in enumerate(PRICE_FACET_EDGES)]
+    return Case(*whens, default=Value(len(PRICE_FACET_EDGES)))
+
+
+def _price_buckets():
+    """[(label, min, max), ...] matching the indexes of _price_bucket_expression()."""
+    bounds = (0, *PRICE_FACET_EDGES, None)
+    buckets = []
+    for low, high in zip(bounds, bounds[1:]):
+        label = f'{low}-{high}' if high is not None else f'{low}+'
+        buckets.append((label, low, high))
+    return buckets
+
+
+def compute_product_facets(queryset, params):
+    """
+    Facet counts for the products in queryset under the current filters.
+
+    One grouped query counts products per (color, fragrance, burning_time,
+    category, price bucket) combination; every facet is then rolled up from
+    those rows in Python. A facet is counted under all the other selected
+    facets but not its own, so its unselected values show how many products
+    selecting them would add. Price range and tags are applied in the query.
+    """
+    selected = selected_facet_values(params)
+    rows = (
+        filter_product_scope(queryset, params)
+        .annotate(price_bucket=_price_bucket_expression())
+        .values(*FACET_FIELDS.values(), 'category__name', 'price_bucket')
+        .annotate(count=Count('id'))
+        .order_by()
+    )
+
+    counts = {facet: {} for facet in FACET_FIELDS}
+    price_counts = {}
+    category_names = {}
+    total = 0
+    for row in rows:
+        category_names[row['category_id']] = row['category__name']
+        unmatched = [facet for facet, values in selected.items() if row[FACET_FIELDS[facet]] not in values]
+        if len(unmatched) > 1:
+            continue
+        for facet, field in FACET_FIELDS.items():
+            if not unmatched or unmatched == [facet]:
+                facet_counts = counts[facet]
+                facet_counts[row[field]] = facet_counts.get(row[field], 0) + row['count']
+        if not unmatched:
+            total += row['count']
+            price_counts[row['price_bucket']] = price_counts.get(row['price_bucket'], 0) + row['count']
+
+    facets = {}
+    for facet, facet_counts in counts.items():
+        chosen = selected.get(facet, set())
+        options = []
+        for value, count in sorted(facet_counts.items(), key=lambda item: (-item[1], str(item[0]))):
+            if value in ('', None):
+                continue
+            option = {'value': value, 'count': count, 'selected': value in chosen}
+            if facet == 'category':
+                option['label'] = category_names.get(value)
+            options.append(option)
+        facets[facet] = options
+    facets['price'] = [
+        {'value': label, 'min': low, 'max': high, 'count': price_counts[index]}
+        for index, (label, low, high) in enumerate(_price_buckets())
+        if price_counts.get(index)
+    ]
+    return {'count': total, 'facets': facets}
+
+
+def get_product_facets(params):
+    """
+    Cached compute_product_facets() over the whole catalog. Entries are keyed
+    by the normalized filter set, so equivalent queries share one entry, and
+    expire together when any product or category changes.
+    """
+    selected = selected_facet_values(params)
+    normalized = [(facet, sorted(selected[facet], key=str)) for facet in sorted(selected)]
+    for name in ('min_price', 'max_price'):
+        value = _decimal_param(params, name)
+        normalized.append((name, str(value.normalize()) if value is not None else None))
+    tags = sorted(name.lower() for name in _list_param(params, 'tags'))
+    normalized.append(('tags', tags, params.get('tags_mode') == 'all' if tags else None))
+    digest = hashlib.sha1(json.dumps(normalized).encode()).hexdigest()
+
+    cache_key = f"product_facets:{get_cache_version(PRODUCT_FACETS_VERSION_KEY)}:{digest}"
+    data = cache.get(cache_key)
+    if data is None:
+        data = compute_product_facets(Product.objects.all(), params)
+        cache.set(cache_key, data, timeout=PRODUCT_FACETS_TIMEOUT)
+    return data
@@ -0,0 +1,152 @@
+import re
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import F
+from .models import Product
+
+# Text search configuration used for the Postgres tsvector column
+SEARCH_CONFIG = 'english'
+# Indexed columns and their weight, most significant first
+SEARCH_FIELDS = (
+    ('name', 'A'),
+    ('tags', 'B'),
+    ('fragrance', 'B'),
+    ('color', 'B'),
+    ('description', 'C'),
+)
+# SQLite shadow table, one row per product with rowid = product id
+FTS_TABLE = 'api_product_fts'
+FTS_COLUMNS = ('name', 'description', 'tags', 'fragrance', 'color')
+# bm25() column weights, in FTS_COLUMNS order
+FTS_WEIGHTS = (10.0, 1.0, 4.0, 4.0, 4.0)
+# Upper bound on ranked matches a single query will page through
+SEARCH_MAX_RESULTS = 1000
+HIGHLIGHT_START = '<mark>'
+HIGHLIGHT_STOP = '</mark>'
+
+_TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def search_backend():
+    """Returns 'postgres', 'sqlite' or None when full-text search is unsupported."""
+    if connection.vendor == 'postgresql':
+        return 'postgres'
+    if connection.vendor == 'sqlite':
+        return 'sqlite'
+    return None
+
+
+def product_search_vector():
+    """Weighted tsvector expression the Postgres search_vector column is filled with."""
+    vector = None
+    for field, weight in SEARCH_FIELDS:
+        part = SearchVector(field, weight=weight, config=SEARCH_CONFIG)
+        vector = part if vector is None else vector + part
+    return vector
+
+
+def _fts_query(query):
+    """
+    Turns free text into an FTS5 expression: every word must match, the last
+    one as a prefix so results follow the user while they type.
+    Quoting each term keeps FTS5 operators in user input inert.
+    """
+    terms = _TERM_RE.findall(query)
+    if not terms:
+        return None
+    quoted = ['"%s"' % term for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def update_search_index(product_ids):
+    """Re-indexes the given products after they were created or changed."""
+    product_ids = list(product_ids)
+    if not product_ids:
+        return
+    backend = search_backend()
+    if backend == 'postgres':
+        Product.objects.filter(pk__in=product_ids).update(search_vector=product_search_vector())
+    elif backend == 'sqlite':
+        placeholders = ', '.join(['%s'] * len(product_ids))
+        columns = ', '.join(FTS_COLUMNS)
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})", product_ids)
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, {columns}) "
+                f"SELECT id, {columns} FROM {Product._meta.db_table} WHERE id IN ({placeholders})",
+                product_ids,
+            )
+
+
+def remove_from_search_index(product_ids):
+    """Drops deleted products from the SQLite shadow table (Postgres rows go with the product)."""
+    product_ids = list(product_ids)
+    if not product_ids or search_backend() != 'sqlite':
+        return
+    placeholders = ', '.join(['%s'] * len(product_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})", product_ids)
+
+
+def search_product_ids(query):
+    """
+    Returns [(product_id, rank), ...] for every match, best first.
+    Only ids and ranks are computed here so the whole result set can be
+    paginated cheaply; highlights are built for the visible page only.
+    """
+    backend = search_backend()
+    if backend == 'postgres':
+        search_query = SearchQuery(query, search_type='websearch', config=SEARCH_CONFIG)
+        matches = (
+            Product.objects.filter(search_vector=search_query)
+            .annotate(rank=SearchRank(F('search_vector'), search_query))
+            .order_by('-rank', 'id')
+            .values_list('id', 'rank')
+        )
+        return list(matches[:SEARCH_MAX_RESULTS])
+    if backend == 'sqlite':
+        fts_query = _fts_query(query)
+        if fts_query is None:
+            return []
+        weights = ', '.join(str(weight) for weight in FTS_WEIGHTS)
+        with connection.cursor() as cursor:
+            # bm25() is lower for better matches; negate it so a higher rank is better
+            cursor.execute(
+                f"SELECT rowid, -bm25({FTS_TABLE}, {weights}) AS rank FROM {FTS_TABLE} "
+                f"WHERE {FTS_TABLE} MATCH %s ORDER BY rank DESC, rowid LIMIT %s",
+                [fts_query, SEARCH_MAX_RESULTS],
+            )
+            return cursor.fetchall()
+    return []
+
+
+def search_highlights(query, product_ids):
+    """Returns {product_id: snippet} with the matched terms wrapped in <mark>."""
+    product_ids = list(product_ids)
+    if not product_ids:
+        return {}
+    backend = search_backend()
+    if backend == 'postgres':
+        search_query = SearchQuery(query, search_type='websearch', config=SEARCH_CONFIG)
+        highlights = Product.objects.filter(pk__in=product_ids).annotate(
+            highlight=SearchHeadline(
+                'description', search_query, config=SEARCH_CONFIG,
+                start_sel=HIGHLIGHT_START, stop_sel=HIGHLIGHT_STOP, max_words=30, min_words=10,
+            )
+        ).values_list('id', 'highlight')
+        return dict(highlights)
+    if backend == 'sqlite':
+        fts_query = _fts_query(query)
+        if fts_query is None:
+            return {}
+        placeholders = ', '.join(['%s'] * len(product_ids))
+        with connection.cursor() as cursor:
+            # Column -1 lets FTS5 pick the column with the best matching fragment
+            cursor.execute(
+                f"SELECT rowid, snippet({FTS_TABLE}, -1, %s, %s, '…', 16) FROM {FTS_TABLE} "
+                f"WHERE {FTS_TABLE} MATCH %s AND rowid IN ({placeholders})",
+                [HIGHLIGHT_START, HIGHLIGHT_STOP, fts_query, *product_ids],
+            )
+            return dict(cursor.fetchall())
+    return {}
@@ -1,34 +1,50 @@
+from django.db import transaction
+from django.db.models import Q
 from rest_framework import serializers
 from .models import *
 from .helpers import *
+from .category_utils import create_category_trees
+from .image_utils import derivative_urls
+from .pricing_utils import OfferResolver, get_offer_resolver, invalidate_offer_index, schedule_effective_price_refresh
+from .variant_utils import bulk_create_variants
 ###########################  Category ##################################
 
+class CategoryListSerializer(serializers.ListSerializer):
+    def validate(self, data):
+        root_names = [item['name'].strip() for item in data if item.get('parent') is None]
+        if len(root_names) != len(set(root_names)):
+            raise serializers.ValidationError({"name": "Root category names must be unique."})
+        existing = Category.objects.filter(name__in=root_names, parent__isnull=True).values_list('name', flat=True)
+        if existing:
+            raise serializers.ValidationError({"name": f"Root categories with these names already exist: {', '.join(existing)}."})
+        return data
+
+    def create(self, validated_data):
+        return create_category_trees(validated_data)
+
+
 class CategorySerializer(serializers.ModelSerializer):
     subcategories = serializers.ListSerializer(child=serializers.DictField(), required=False, write_only=True)
 
     class Meta:
         model = Category
         fields = ['id', 'name', 'parent', 'description', 'is_active', 'subcategories']
+        list_serializer_class = CategoryListSerializer
         
     
     def validate(self, data):
         name = data.get('name', '').strip()
         if len(name) < 3:
             raise serializers.ValidationError({"name": "The category name must be at least 3 characters long."})
-        if data.get('parent') is None:
+        # Bulk payloads check every root name in one query in CategoryListSerializer
+        if data.get('parent') is None and not isinstance(self.parent, serializers.ListSerializer):
             if Category.objects.filter(name=name, parent__isnull=True).exists():
                 raise serializers.ValidationError({"name": "A root category with this name already exists."})
         
         return data
     
     def create(self, validated_data):
-        subcategories_data = validated_data.pop('subcategories', [])
-        category = Category.objects.create(**validated_data)
-        for subcategory_data in subcategories_data:
-            subcategory_data['parent'] = category
-            # Recursively create subcategories
-            self.create(subcategory_data)
-        return category
+        return create_category_trees([validated_data])[0]
 
 class CategoryUpdateSerializer(serializers.ModelSerializer):
     class Meta:
@@ -47,6 +63,9 @@ class CategoryUpdateSerializer(serializers.ModelSerializer):
         if 'parent' in data and data.get('parent') is None:
             if Category.objects.filter(name=name, parent__isnull=True).exists():
                 raise serializers.ValidationError({"name": "A root category with this name already exists."})
+        parent = data.get('parent')
+        if self.instance and parent and parent.path.startswith(self.instance.path):
+            raise serializers.ValidationError({"parent": "A category cannot be moved below itself or its subcategories."})
         
         return data
     
@@ -59,27 +78,64 @@ class CategoryTreeSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'parent', 'description', 'subcategories']
 
     def get_subcategories(self, obj):
-        subcategories = obj.subcategories.filter(is_active=True)
+        # Nodes built by category_utils.build_category_tree() carry their children already
+        subcategories = getattr(obj, 'tree_children', None)
+        if subcategories is None:
+            subcategories = obj.subcategories.filter(is_active=True)
         return CategoryTreeSerializer(subcategories, many=True).data
     
 
 
 ############################ Variant ##########################
 
+class VariantOptionIdsField(serializers.ListField):
+    """Option ids of a variant. Plain integers, so validating them never queries per id."""
+    child = serializers.IntegerField(min_value=1)
+
+    def to_representation(self, value):
+        return [option.pk for option in value.all()]
+
+
+class VariantDetailListSerializer(serializers.ListSerializer):
+    def validate(self, data):
+        # Every option id of every variant is checked with a single IN query
+        option_ids = {option_id for variant in data for option_id in variant['variant_options']}
+        missing = sorted(option_ids - set(
+            VariantOption.objects.filter(id__in=option_ids).values_list('id', flat=True)
+        ))
+        if missing:
+            raise serializers.ValidationError(f"Invalid variant options: {', '.join(map(str, missing))}.")
+        return data
+
+
 class VariantDetailSerializer(serializers.ModelSerializer):
-    variant_options = serializers.PrimaryKeyRelatedField(
-        queryset=VariantOption.objects.all(),
-        many=True
-    )
+    variant_options = VariantOptionIdsField()
     price_with_offer = serializers.SerializerMethodField()
     
 
     class Meta:
         model = VariantDetail
-        fields = ['variant_options', 'original_price', 'current_price', 'price_with_offer','variant_data','stock']
+        fields = ['variant_options', 'original_price', 'current_price', 'price_with_offer', 'effective_price', 'variant_data','stock']
+        list_serializer_class = VariantDetailListSerializer
     
     def get_price_with_offer(self, obj):
-        return obj.get_variant_price_with_offer()
+        return get_offer_resolver(self.context).get_variant_price(obj)
+
+class VariantLookupSerializer(serializers.ModelSerializer):
+    """A variant found by its options; the option ids come from its signature, not the M2M table."""
+    variant_options = serializers.SerializerMethodField()
+    price_with_offer = serializers.SerializerMethodField()
+
+    class Meta:
+        model = VariantDetail
+        fields = ['id', 'product', 'variant_options', 'original_price', 'current_price', 'price_with_offer',
+                  'effective_price', 'variant_data', 'stock']
+
+    def get_variant_options(self, obj):
+        return [int(option_id) for option_id in obj.option_signature.split(',') if option_id]
+
+    def get_price_with_offer(self, obj):
+        return get_offer_resolver(self.context).get_variant_price(obj)
 
 class VariantTypeSerializer(serializers.ModelSerializer):
     class Meta:
@@ -95,23 +151,50 @@ class VariantOptionSerializer(serializers.ModelSerializer):
 
 ############################ Product ##########################
 
+class ImageDerivativesField(serializers.Field):
+    """Read-only URLs of the resized copies of an image, by size and format."""
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        return derivative_urls(value, self.context.get('request'))
+
+
+class ProductListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        # Price the whole page against the same instant of the offer index
+        self.context['offer_resolver'] = OfferResolver()
+        return super().to_representation(data)
+
+
 class ProductSerializer(serializers.ModelSerializer):
     category = serializers.PrimaryKeyRelatedField(queryset=Category.objects.all())
     variants = VariantDetailSerializer(many=True, required=False)  # Add the nested variants
     price_with_offer = serializers.SerializerMethodField()  # Add this field
+    image_urls = ImageDerivativesField(source='image_derivatives')
 
     class Meta:
         model = Product
         fields = [
             'id', 'name', 'description', 'category', 'sku', 
-            'original_price', 'current_price', 'price_with_offer','size', 'weight', 
+            'original_price', 'current_price', 'price_with_offer', 'effective_price', 'size', 'weight', 
             'burning_time', 'color', 'fragrance', 'in_the_box', 
-            'stock', 'tags', 'image_url', 'variants'  # Include variants
+            'stock', 'tags', 'image_url', 'image_urls', 'variants'  # Include variants
         ]
+        list_serializer_class = ProductListSerializer
+
+    def get_fields(self):
+        fields = super().get_fields()
+        # Sparse fieldsets: views pass the requested field names through the context
+        requested = self.context.get('fields')
+        if requested is not None:
+            fields = {name: field for name, field in fields.items() if name in requested}
+        return fields
     
     def get_price_with_offer(self, obj):
         """This method computes the price after applying any active offer."""
-        return obj.get_price_with_offer()  # This calls the method in the Product model
+        return get_offer_resolver(self.context).get_price(obj)
     
     def validate(self, data):
         if data['original_price'] < data['current_price']:
@@ -133,6 +216,7 @@ class ProductSerializer(serializers.ModelSerializer):
 
         return data
 
+    @transaction.atomic
     def create(self, validated_data):
         variants_data = validated_data.pop('variants', [])
         product = Product.objects.create(**validated_data)
@@ -143,12 +227,38 @@ class ProductSerializer(serializers.ModelSerializer):
         return product
 
     def _create_variants(self, product, variants_data):
-        """Helper function to handle variant creation"""
+        """Creates all variants with one insert, and all their option links with another."""
+        variants = []
         for variant_data in variants_data:
             variant_options = variant_data.pop('variant_options')
-            variant = VariantDetail.objects.create(product=product, **variant_data)
-            variant.variant_options.set(variant_options)  # Set the Many-to-Many field
-            variant.save()
+            variants.append((VariantDetail(product=product, **variant_data), variant_options))
+        bulk_create_variants(variants)
+
+
+class ProductSearchResultSerializer(ProductSerializer):
+    """A product search hit: the product plus its relevance and a highlighted snippet."""
+    search_rank = serializers.FloatField(read_only=True)
+    highlight = serializers.CharField(source='search_highlight', read_only=True, allow_null=True)
+
+    class Meta(ProductSerializer.Meta):
+        fields = ProductSerializer.Meta.fields + ['search_rank', 'highlight']
+
+
+class CatalogVariantSerializer(VariantDetailSerializer):
+    """A variant in an import row. Option ids are checked per batch by catalog_utils."""
+
+    class Meta(VariantDetailSerializer.Meta):
+        list_serializer_class = serializers.ListSerializer
+
+
+class CatalogRowSerializer(ProductSerializer):
+    """
+    One product of a catalog import. Same rules as ProductSerializer, but the
+    category and variant option ids are plain integers so validating a row
+    never queries; catalog_utils resolves them for the whole batch at once.
+    """
+    category = serializers.IntegerField(min_value=1)
+    variants = CatalogVariantSerializer(many=True, required=False)
 
 ############################ User ##########################
 
@@ -250,6 +360,50 @@ class CartSerializer(serializers.ModelSerializer):
         
         return data
 
+
+CART_BATCH_MAX_OPERATIONS = 200
+
+
+class CartOperationSerializer(serializers.Serializer):
+    """One line of a cart batch. Ids are plain integers; CartBatchSerializer checks them all at once."""
+    op = serializers.ChoiceField(choices=['add', 'set', 'remove'])
+    product = serializers.IntegerField(min_value=1)
+    variant = serializers.IntegerField(min_value=1, allow_null=True, default=None)
+    quantity = serializers.IntegerField(default=1)
+
+    def validate(self, data):
+        if data['op'] == 'set' and data['quantity'] < 0:
+            raise serializers.ValidationError({'quantity': "Can't set a negative quantity."})
+        return data
+
+
+class CartBatchSerializer(serializers.Serializer):
+    operations = CartOperationSerializer(many=True, allow_empty=False, max_length=CART_BATCH_MAX_OPERATIONS)
+
+    def validate_operations(self, operations):
+        # Every product and variant of the batch is checked with one IN query each
+        product_ids = set(Product.objects.filter(
+            id__in={operation['product'] for operation in operations}
+        ).values_list('id', flat=True))
+        variant_products = dict(VariantDetail.objects.filter(
+            id__in={operation['variant'] for operation in operations if operation['variant'] is not None}
+        ).values_list('id', 'product_id'))
+
+        errors = []
+        for operation in operations:
+            error = {}
+            if operation['product'] not in product_ids:
+                error['product'] = [f'Invalid pk "{operation["product"]}" - object does not exist.']
+            elif operation['variant'] is not None:
+                if operation['variant'] not in variant_products:
+                    error['variant'] = [f'Invalid pk "{operation["variant"]}" - object does not exist.']
+                elif variant_products[operation['variant']] != operation['product']:
+                    error['variant'] = ["The variant does not belong to the selected product."]
+            errors.append(error)
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return operations
+
 ############################ Address ##########################
 
 class AddressSerializer(serializers.ModelSerializer):
@@ -284,24 +438,123 @@ class OrderSerializer(serializers.ModelSerializer):
 
 ############################ Offer ##########################
 
+class OfferListSerializer(serializers.ListSerializer):
+    def to_internal_value(self, data):
+        """
+        Checks a batch of offers for overlaps with each other and with the
+        stored active offers: one range query, then a sort-and-sweep per target.
+        Errors are reported per item like field errors.
+        """
+        data = super().to_internal_value(data)
+        offers = [Offer(**attrs) for attrs in data]
+        active = [(index, offer) for index, offer in enumerate(offers) if offer.is_active]
+        if not active:
+            return data
+
+        intervals = {}
+        for index, offer in active:
+            intervals.setdefault(offer.get_target(), []).append((offer.start_date, offer.end_date, index))
+
+        product_ids = [target_id for (offer_type, target_id) in intervals if offer_type == 'product']
+        category_ids = [target_id for (offer_type, target_id) in intervals if offer_type == 'category']
+        existing = Offer.objects.filter(
+            Q(product_id__in=product_ids) | Q(category_id__in=category_ids),
+            is_active=True,
+            start_date__lte=max(offer.end_date for _, offer in active),
+            end_date__gte=min(offer.start_date for _, offer in active),
+        ).only('product_id', 'category_id', 'start_date', 'end_date')
+        for offer in existing:
+            for target in (('product', offer.product_id), ('category', offer.category_id)):
+                if target in intervals:
+                    intervals[target].append((offer.start_date, offer.end_date, None))
+
+        errors = [{} for _ in data]
+        for target_intervals in intervals.values():
+            target_intervals.sort(key=lambda interval: (interval[0], interval[1]))
+            latest = None
+            for interval in target_intervals:
+                if latest is not None and interval[0] <= latest[1]:
+                    for index in (interval[2], latest[2]):
+                        if index is not None:
+                            errors[index] = {"non_field_errors": ["This offer overlaps another active offer for the same target."]}
+                if latest is None or interval[1] > latest[1]:
+                    latest = interval
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return data
+
+    def create(self, validated_data):
+        with transaction.atomic():
+            offers = Offer.objects.bulk_create([Offer(**attrs) for attrs in validated_data])
+            # bulk_create skips the Offer signals
+            transaction.on_commit(invalidate_offer_index)
+            transaction.on_commit(lambda: schedule_effective_price_refresh(
+                [(offer.product_id, offer.category_id, offer.start_date, offer.end_date) for offer in offers]
+            ))
+        return offers
+
+
 class OfferSerializer(serializers.ModelSerializer):
     class Meta:
         model = Offer
         fields = '__all__'
+        list_serializer_class = OfferListSerializer
 
     def validate(self, attrs):
-        """Validate offer dates and ensure only one active offer per product/category."""
-        if attrs['start_date'] >= attrs['end_date']:
+        """Validate offer dates and ensure active offers for a product/category never overlap."""
+        offer = Offer(**{**self._instance_values(), **attrs})
+        if offer.start_date >= offer.end_date:
             raise serializers.ValidationError("End date must be after start date.")
         
-        if attrs['offer_type'] == 'product':
-            if Offer.objects.filter(product=attrs['product'], is_active=True).exists():
-                raise serializers.ValidationError("There is already an active offer for this product.")
-        elif attrs['offer_type'] == 'category':
-            if Offer.objects.filter(category=attrs['category'], is_active=True).exists():
-                raise serializers.ValidationError("There is already an active offer for this category.")
+        if offer.offer_type == 'product' and offer.product_id is None:
+            raise serializers.ValidationError({"product": "A product offer needs a product."})
+        if offer.offer_type == 'category' and offer.category_id is None:
+            raise serializers.ValidationError({"category": "A category offer needs a category."})
+
+        # Batches are checked together in OfferListSerializer
+        if not offer.is_active or isinstance(self.parent, serializers.ListSerializer):
+            return attrs
+
+        overlapping = Offer.objects.filter(
+            is_active=True,
+            start_date__lte=offer.end_date,
+            end_date__gte=offer.start_date,
+        )
+        if self.instance is not None:
+            overlapping = overlapping.exclude(pk=self.instance.pk)
+        if offer.offer_type == 'product':
+            if overlapping.filter(product_id=offer.product_id).exists():
+                raise serializers.ValidationError("There is already an active offer for this product in this period.")
+        elif overlapping.filter(category_id=offer.category_id).exists():
+            raise serializers.ValidationError("There is already an active offer for this category in this period.")
         
         return attrs
+
+    def _instance_values(self):
+        if self.instance is None:
+            return {}
+        return {field: getattr(self.instance, field) for field in (
+            'name', 'offer_type', 'discount_type', 'discount_value', 'start_date', 'end_date',
+            'product', 'category', 'is_active',
+        )}
+    
+class SimulatedDiscountSerializer(serializers.Serializer):
+    discount_type = serializers.ChoiceField(choices=Offer.DISCOUNT_TYPE_CHOICES)
+    discount_value = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal('0'))
+    category = serializers.PrimaryKeyRelatedField(queryset=Category.objects.all(), required=False)
+    skus = serializers.ListField(child=serializers.CharField(), required=False, allow_empty=False)
+
+    def validate(self, data):
+        if ('category' in data) == ('skus' in data):
+            raise serializers.ValidationError("Provide either a category or a list of skus.")
+        if data['discount_type'] == 'percentage' and data['discount_value'] > 100:
+            raise serializers.ValidationError({"discount_value": "A percentage discount cannot exceed 100."})
+        return data
+
+
+class OfferSimulationSerializer(serializers.Serializer):
+    discounts = SimulatedDiscountSerializer(many=True, allow_empty=False)
+    top = serializers.IntegerField(default=20, min_value=1, max_value=100)
     
 ############################ Coupen ##########################
 
@@ -327,9 +580,11 @@ class ApplyCouponSerializer(serializers.Serializer):
 ############################ Testmonials ##########################
 
 class TestimonialSerializer(serializers.ModelSerializer):
+    profile_image_urls = ImageDerivativesField(source='profile_image_derivatives')
+
     class Meta:
         model = Testimonial
-        fields = ['id', 'name', 'profile_image', 'testimonial_text', 'rating', 'approved', 'created_at', 'updated_at']
+        fields = ['id', 'name', 'profile_image', 'profile_image_urls', 'testimonial_text', 'rating', 'approved', 'created_at', 'updated_at']
         read_only_fields = ['id', 'created_at', 'updated_at']
 
 
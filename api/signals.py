@@ -1,11 +1,151 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
 from django.dispatch import receiver
-from .models import OTP
+from django.db import transaction
+from .models import OTP, Category, ExtendedUserModel, Offer, Product, Testimonial, VariantDetail, VariantOption
 from .helpers import send_otp_email
+from .cache_utils import PRODUCT_FACETS_VERSION_KEY, bump_cache_version, invalidate_product_cache
+from .category_utils import invalidate_category_tree
+from .pricing_utils import invalidate_offer_index, queue_effective_price_refresh, schedule_effective_price_refresh
+from .search_utils import remove_from_search_index, update_search_index
+from .tag_utils import sync_product_tags
+from .image_utils import IMAGE_DERIVATIVE_FIELDS, needs_derivatives, schedule_derivatives
+from .variant_utils import VariantOptionLink, refresh_option_signatures
 
 @receiver(post_save, sender=OTP)
 def send_otp_signal(sender, instance, created, **kwargs):
     print(f"Signal called for OTP with email: {instance.email}")
     if created:
         print( "Signal Called created")
-        send_otp_email(instance.email, instance.otp)
\ No newline at end of file
+        send_otp_email(instance.email, instance.otp)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_tree_signal(sender, instance, **kwargs):
+    # After commit: post_save fires before save() rewrites paths and the subtree,
+    # and a version bumped earlier could be re-cached with the old tree
+    transaction.on_commit(invalidate_category_tree)
+    # Facets label categories by name
+    transaction.on_commit(lambda: bump_cache_version(PRODUCT_FACETS_VERSION_KEY))
+    # Category offers are inherited through the ancestry the offer index keeps
+    transaction.on_commit(invalidate_offer_index)
+
+
+@receiver(post_save, sender=Category)
+def refresh_category_prices_signal(sender, instance, **kwargs):
+    # Moving a category changes which ancestor offers its products inherit. Checked
+    # after commit, as save() only knows the category moved once it rewrote the path
+    def refresh_if_moved():
+        if getattr(instance, 'moved', False):
+            queue_effective_price_refresh(category_ids=[instance.pk])
+
+    transaction.on_commit(refresh_if_moved)
+
+
+@receiver(post_save, sender=Offer)
+@receiver(post_delete, sender=Offer)
+def invalidate_offer_index_signal(sender, instance, **kwargs):
+    transaction.on_commit(invalidate_offer_index)
+
+
+@receiver(pre_save, sender=Offer)
+def remember_offer_target_signal(sender, instance, **kwargs):
+    # Prices under the previous product/category need a refresh when an offer is moved
+    instance._previous_target = Offer.objects.filter(pk=instance.pk).values_list('product_id', 'category_id').first()
+
+
+@receiver(post_save, sender=Offer)
+@receiver(post_delete, sender=Offer)
+def refresh_effective_prices_signal(sender, instance, **kwargs):
+    offers = [(instance.product_id, instance.category_id, instance.start_date, instance.end_date)]
+    previous_target = getattr(instance, '_previous_target', None)
+    if previous_target and previous_target != (instance.product_id, instance.category_id):
+        offers.append((*previous_target, instance.start_date, instance.end_date))
+    transaction.on_commit(lambda: schedule_effective_price_refresh(offers))
+
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_cache_signal(sender, instance, **kwargs):
+    product_id = instance.pk  # Cleared on the instance once a delete completes
+    transaction.on_commit(lambda: invalidate_product_cache([product_id]))
+
+
+@receiver(post_save, sender=VariantDetail)
+@receiver(post_delete, sender=VariantDetail)
+def invalidate_variant_product_cache_signal(sender, instance, **kwargs):
+    transaction.on_commit(lambda: invalidate_product_cache([instance.product_id]))
+
+
+@receiver(m2m_changed, sender=VariantDetail.variant_options.through)
+def invalidate_variant_options_cache_signal(sender, instance, action, **kwargs):
+    if action.startswith('post_') and isinstance(instance, VariantDetail):
+        transaction.on_commit(lambda: invalidate_product_cache([instance.product_id]))
+
+
+@receiver(post_save, sender=Product)
+def update_product_search_index(sender, instance, **kwargs):
+    # Same transaction as the row itself, so search never sees a stale document
+    update_search_index([instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+def remove_product_search_index(sender, instance, **kwargs):
+    remove_from_search_index([instance.pk])
+
+
+@receiver(post_save, sender=Product)
+def sync_product_tags_signal(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and 'tags' not in update_fields:
+        return
+    if 'tags' in instance.get_deferred_fields():
+        return
+    if not created and instance.tags == getattr(instance, '_loaded_tags', None):
+        return
+    sync_product_tags([instance])
+    instance._loaded_tags = instance.tags
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ExtendedUserModel)
+@receiver(post_save, sender=Testimonial)
+def schedule_image_derivatives_signal(sender, instance, update_fields=None, **kwargs):
+    # Resizing runs in Celery so uploads return as soon as the original is stored
+    label, pk = instance._meta.label_lower, instance.pk
+    if update_fields is not None and IMAGE_DERIVATIVE_FIELDS[label][0] not in update_fields:
+        return
+    if set(IMAGE_DERIVATIVE_FIELDS[label]) & instance.get_deferred_fields():
+        return
+    if needs_derivatives(instance):
+        transaction.on_commit(lambda: schedule_derivatives(label, [pk]))
+
+
+@receiver(m2m_changed, sender=VariantDetail.variant_options.through)
+def sync_option_signature_signal(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        # variant.variant_options.add()/remove()/set()/clear()
+        if action.startswith('post_'):
+            instance.option_signature = refresh_option_signatures([instance.pk])[instance.pk]
+    elif action == 'pre_clear':
+        # option.variantdetail_set.clear(): the affected variants are unknown afterwards
+        instance._linked_variant_ids = list(
+            VariantOptionLink.objects.filter(variantoption_id=instance.pk).values_list('variantdetail_id', flat=True)
+        )
+    elif action == 'post_clear':
+        refresh_option_signatures(instance._linked_variant_ids)
+    elif action in ('post_add', 'post_remove'):
+        refresh_option_signatures(pk_set)
+
+
+@receiver(pre_delete, sender=VariantOption)
+def collect_option_variants_signal(sender, instance, **kwargs):
+    # The links go away in the cascade without an m2m_changed signal
+    instance._linked_variant_ids = list(
+        VariantOptionLink.objects.filter(variantoption_id=instance.pk).values_list('variantdetail_id', flat=True)
+    )
+
+
+@receiver(post_delete, sender=VariantOption)
+def refresh_option_variants_signal(sender, instance, **kwargs):
+    refresh_option_signatures(getattr(instance, '_linked_variant_ids', ()))
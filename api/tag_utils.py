@@ -0,0 +1,69 @@
+from django.db.models import Count, Q
+from .models import Product, Tag
+
+ProductTag = Product.tag_set.through
+
+
+def parse_tags(value):
+    """Splits a Product.tags string into its normalized, de-duplicated tag names."""
+    names = []
+    for name in (value or '').split(','):
+        name = name.strip().lower()
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def get_tag_ids(names):
+    """Returns {name: id}, creating the missing tags with a single insert."""
+    names = set(names)
+    if not names:
+        return {}
+    Tag.objects.bulk_create([Tag(name=name) for name in names], ignore_conflicts=True)
+    return dict(Tag.objects.filter(name__in=names).values_list('name', 'id'))
+
+
+def sync_product_tags(products):
+    """
+    Brings the tag_set rows of the given products in line with their tags
+    strings. Only the difference is written, with one bulk insert and one
+    delete for the whole batch.
+    """
+    wanted = {product.pk: parse_tags(product.tags) for product in products}
+    if not wanted:
+        return
+    tag_ids = get_tag_ids(name for names in wanted.values() for name in names)
+    wanted_rows = {
+        (product_id, tag_ids[name]) for product_id, names in wanted.items() for name in names
+    }
+    existing_rows = set(
+        ProductTag.objects.filter(product_id__in=wanted).values_list('product_id', 'tag_id')
+    )
+
+    stale = existing_rows - wanted_rows
+    if stale:
+        stale_tags = {}
+        for product_id, tag_id in stale:
+            stale_tags.setdefault(product_id, []).append(tag_id)
+        condition = Q()
+        for product_id, ids in stale_tags.items():
+            condition |= Q(product_id=product_id, tag_id__in=ids)
+        ProductTag.objects.filter(condition).delete()
+    ProductTag.objects.bulk_create(
+        [ProductTag(product_id=product_id, tag_id=tag_id) for product_id, tag_id in wanted_rows - existing_rows],
+        ignore_conflicts=True,
+    )
+
+
+def filter_by_tags(queryset, names, match_all=False):
+    """
+    Products tagged with any (or all) of names. Both resolve through the
+    unique tag name index and the indexed tag_set table, never a text scan.
+    """
+    names = {name.strip().lower() for name in names if name.strip()}
+    if not names:
+        return queryset
+    rows = ProductTag.objects.filter(tag__name__in=names)
+    if match_all:
+        rows = rows.values('product_id').annotate(matched=Count('tag_id')).filter(matched=len(names))
+    return queryset.filter(pk__in=rows.values('product_id'))
@@ -3,6 +3,10 @@ from django.core.mail import send_mail
 from django.conf import settings
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
+import requests
+from django.apps import apps
+from .pricing_utils import refresh_effective_prices
+from .image_utils import generate_derivatives
 
 
 @shared_task
@@ -40,6 +44,18 @@ def send_notification_email(email, subject, message):
         return False
     
 
+@shared_task
+def refresh_effective_prices_task(product_ids=None, category_ids=None):
+    return refresh_effective_prices(product_ids=product_ids, category_ids=category_ids)
+
+
+@shared_task(autoretry_for=(requests.RequestException,), retry_backoff=True, max_retries=3)
+def generate_image_derivatives_task(model_label, pk):
+    instance = apps.get_model(model_label).objects.filter(pk=pk).first()
+    if instance is not None:
+        generate_derivatives(instance)
+
+
 channel_layer = get_channel_layer()
 
 async_to_sync(channel_layer.group_send)(
@@ -1,3 +1,341 @@
-from django.test import TestCase
+import base64
+import json
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from .catalog_utils import import_catalog
+from .cache_utils import PRODUCT_FACETS_VERSION_KEY, get_cache_version
+from .category_utils import CATEGORY_TREE_VERSION_KEY
+from .helpers import add_or_update_cart
+from .models import Cart, Category, Offer, Product, VariantDetail, VariantOption, VariantType
+from .pricing_utils import ActiveOfferIndex, invalidate_offer_index, refresh_effective_prices, simulate_offers
 
-# Create your tests here.
+
+def create_product(category, **fields):
+    values = {
+        'name': 'Floating candle', 'description': 'Unscented', 'sku': 'SKU-1',
+        'original_price': Decimal('100.00'), 'current_price': Decimal('90.00'), 'size': 'S',
+        'weight': Decimal('10.00'), 'burning_time': '2 hours', 'color': 'white', 'fragrance': 'none',
+        'in_the_box': '1 candle', 'stock': 10,
+    }
+    values.update(fields)
+    return Product.objects.create(category=category, **values)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ProductQueryCountTests(TestCase):
+    """Rendering products must cost a fixed number of queries, whatever the page or variant count."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Candles')
+        variant_type = VariantType.objects.create(name='Size')
+        cls.options = [VariantOption.objects.create(variant_type=variant_type, option_value=value) for value in 'SML']
+        for index in range(12):
+            product = create_product(cls.category, sku=f'SKU-{index}')
+            cls.add_variants(product, 2)
+
+    @classmethod
+    def add_variants(cls, product, count):
+        for _ in range(count):
+            variant = VariantDetail.objects.create(
+                product=product, original_price=Decimal('100.00'), current_price=Decimal('90.00'), stock=5,
+            )
+            variant.variant_options.set(cls.options)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('shopper'))
+        # Loads the active offer index, which later requests reuse from the cache
+        self.client.get('/api/products/all/?page_size=1')
+
+    def test_product_list_with_variants(self):
+        for page_size in (3, 10):
+            # Count, page, variants, option ids
+            with self.assertNumQueries(4):
+                response = self.client.get(f'/api/products/all/?expand=variants&page_size={page_size}')
+            self.assertEqual(len(response.data['results']), page_size)
+
+    def test_products_by_category(self):
+        for page_size in (3, 10):
+            with self.assertNumQueries(4):
+                response = self.client.get(
+                    f'/api/products/category/{self.category.pk}/?expand=variants&page_size={page_size}'
+                )
+            self.assertEqual(len(response.data['results']), page_size)
+
+    def test_product_detail(self):
+        few, many = Product.objects.order_by('id')[:2]
+        self.add_variants(many, 8)
+        for product, variants in ((few, 2), (many, 10)):
+            # The product with its category, then variants and their option ids
+            with self.assertNumQueries(3):
+                response = self.client.get(f'/api/products/detail/{product.pk}/')
+            self.assertEqual(len(response.data['variants']), variants)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ProductCursorPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Candles')
+        for index in range(5):
+            create_product(category, sku=f'SKU-{index}', current_price=Decimal(20 + index % 2))
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('shopper'))
+
+    def test_walks_price_ordering(self):
+        url = '/api/products/all/?pagination=cursor&ordering=price&page_size=2'
+        ids = []
+        while url:
+            response = self.client.get(url)
+            ids += [product['id'] for product in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(ids, list(Product.objects.order_by('effective_price', 'id').values_list('id', flat=True)))
+
+    def test_malformed_cursor_values_are_not_found(self):
+        for position in (['abc'], [None], [[1]], [{'a': 1}]):
+            cursor = base64.urlsafe_b64encode(json.dumps({'p': position}).encode()).decode()
+            response = self.client.get(f'/api/products/all/?cursor={cursor}')
+            self.assertEqual(response.status_code, 404, position)
+        price_cursor = base64.urlsafe_b64encode(json.dumps({'p': ['cheap', '1']}).encode()).decode()
+        response = self.client.get(f'/api/products/all/?ordering=price&cursor={price_cursor}')
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class EffectivePriceTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Candles')
+        self.product = create_product(self.category)
+
+    def test_save_reprices_only_when_pricing_changes(self):
+        product = Product.objects.get(pk=self.product.pk)
+        with mock.patch('api.pricing_utils.refresh_effective_prices') as refresh:
+            product.name = 'Tealight'
+            product.save()
+            product.current_price = Decimal('80.00')
+            product.save(update_fields=['name'])
+            refresh.assert_not_called()
+
+            product.save(update_fields=['current_price'])
+            refresh.assert_called_once_with(product_ids=[product.pk])
+        product.refresh_from_db()
+        self.assertEqual(product.effective_price, Decimal('80.00'))
+
+    def test_broker_outage_does_not_fail_category_move(self):
+        root = Category.objects.create(name='Gifts')
+        with mock.patch('api.tasks.refresh_effective_prices_task.apply_async', side_effect=ConnectionError):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.category.parent = root
+                self.category.save()
+        self.assertEqual(Category.objects.get(pk=self.category.pk).parent_id, root.pk)
+
+    def test_save_syncs_tags_only_when_they_change(self):
+        product = Product.objects.get(pk=self.product.pk)
+        with mock.patch('api.signals.sync_product_tags') as sync:
+            product.stock = 3
+            product.save()
+            sync.assert_not_called()
+
+            product.tags = 'Gift, Vanilla'
+            product.save()
+            product.save()
+            sync.assert_called_once_with([product])
+
+    def test_noop_refresh_keeps_facet_cache(self):
+        version = get_cache_version(PRODUCT_FACETS_VERSION_KEY)
+        self.assertEqual(refresh_effective_prices(), 0)
+        self.assertEqual(get_cache_version(PRODUCT_FACETS_VERSION_KEY), version)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CategoryCacheTests(TestCase):
+    def test_versions_bump_only_after_commit(self):
+        cache.clear()
+        root = Category.objects.create(name='Candles')
+        versions = get_cache_version(CATEGORY_TREE_VERSION_KEY), get_cache_version(PRODUCT_FACETS_VERSION_KEY)
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name='Tealights', parent=root)
+            # A request reading the tree now still sees the committed one, under the old version
+            self.assertEqual(
+                (get_cache_version(CATEGORY_TREE_VERSION_KEY), get_cache_version(PRODUCT_FACETS_VERSION_KEY)), versions
+            )
+        self.assertNotEqual(get_cache_version(CATEGORY_TREE_VERSION_KEY), versions[0])
+        self.assertNotEqual(get_cache_version(PRODUCT_FACETS_VERSION_KEY), versions[1])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ActiveOfferIndexTests(TestCase):
+    def test_rebuild_publishes_a_new_snapshot(self):
+        cache.clear()
+        category = Category.objects.create(name='Candles')
+        product = create_product(category)
+        index = ActiveOfferIndex()
+        before = index.refresh()
+        invalidate_offer_index()
+        now = timezone.now()
+        Offer.objects.create(
+            name='Sale', offer_type='product', discount_type='percentage', discount_value=Decimal('10'),
+            product=product, start_date=now - timedelta(days=1), end_date=now + timedelta(days=1),
+        )
+
+        after = index.refresh(now)
+
+        self.assertIsNot(after, before)
+        # A reader still holding the old snapshot keeps a consistent, unchanged view
+        self.assertIsNone(before.get_offer(product.pk, category.pk, now))
+        self.assertEqual(after.get_offer(product.pk, category.pk, now).name, 'Sale')
+        self.assertIs(index.refresh(now), after)
+
+
+class OfferSimulationTests(TestCase):
+    def test_percentage_of_whole_number_price_keeps_cents(self):
+        # SQLite stores 90.00 as the integer 90; the discount must not truncate to 77
+        category = Category.objects.create(name='Candles')
+        category.refresh_from_db()
+        create_product(category)
+
+        result = simulate_offers([
+            {'discount_type': 'percentage', 'discount_value': Decimal('15'), 'category': category},
+        ])
+
+        self.assertEqual(result['products']['simulated_total'], Decimal('76.50'))
+        self.assertEqual(result['products']['total_change'], Decimal('-13.50'))
+        self.assertEqual(result['top_changes'][0]['simulated_price'], Decimal('76.50'))
+        self.assertEqual(str(result['products']['baseline_total']), '90.00')
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CartConcurrencyTests(TransactionTestCase):
+    """Many requests changing the same cart items at once must neither lose updates nor duplicate items."""
+    threads = 8
+    repeats = 25
+
+    def setUp(self):
+        # Known only once the test database exists, so not checked at import time
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest("Threads can't write concurrently to a shared-cache in-memory SQLite database.")
+        self.user = User.objects.create_user('shopper')
+        category = Category.objects.create(name='Candles')
+        self.product = create_product(category)
+        self.variant = VariantDetail.objects.create(
+            product=self.product, original_price=Decimal('100.00'), current_price=Decimal('90.00'), stock=10,
+        )
+
+    def run_concurrently(self, work):
+        errors = []
+        barrier = threading.Barrier(self.threads)
+
+        def worker():
+            try:
+                barrier.wait()
+                for _ in range(self.repeats):
+                    work()
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connections.close_all()
+
+        workers = [threading.Thread(target=worker) for _ in range(self.threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def cart_quantities(self):
+        items = Cart.objects.filter(user=self.user).values_list('variant_id', 'quantity')
+        return sorted(items, key=lambda item: item[0] or 0)
+
+    def test_concurrent_adds(self):
+        def work():
+            add_or_update_cart(self.user, self.product, None, 1)
+            add_or_update_cart(self.user, self.product, self.variant, 2)
+
+        self.run_concurrently(work)
+        total = self.threads * self.repeats
+        self.assertEqual(self.cart_quantities(), [(None, total), (self.variant.pk, 2 * total)])
+
+    def test_concurrent_decrements(self):
+        total = self.threads * self.repeats
+        add_or_update_cart(self.user, self.product, None, 3 * total + 1)
+        add_or_update_cart(self.user, self.product, self.variant, 3 * total - 1)
+
+        def work():
+            add_or_update_cart(self.user, self.product, None, -3)
+            add_or_update_cart(self.user, self.product, self.variant, -3)
+
+        self.run_concurrently(work)
+        # The last decrement of the variant item takes 3 off 2, which removes it
+        self.assertEqual(self.cart_quantities(), [(None, 1)])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CatalogImportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Candles')
+        variant_type = VariantType.objects.create(name='Size')
+        self.small, self.large = (
+            VariantOption.objects.create(variant_type=variant_type, option_value=value) for value in ('S', 'L')
+        )
+
+    def import_row(self, variants):
+        row = {
+            'sku': 'CAT-1', 'name': 'Pillar candle', 'description': 'Vanilla', 'category': self.category.pk,
+            'original_price': '100.00', 'current_price': '90.00', 'size': 'M', 'weight': '10.00',
+            'burning_time': '8 hours', 'color': 'ivory', 'fragrance': 'vanilla', 'in_the_box': '1 candle',
+            'stock': 5, 'variants': variants,
+        }
+        return import_catalog([(1, row, None)])
+
+    def variant(self, options, current_price='90.00'):
+        return {'variant_options': [option.pk for option in options], 'original_price': '100.00',
+                'current_price': current_price, 'stock': 3}
+
+    def test_reimport_keeps_variant_ids(self):
+        self.import_row([self.variant([self.small]), self.variant([self.large])])
+        product = Product.objects.get(sku='CAT-1')
+        small = product.variants.get(option_signature=str(self.small.pk))
+        user = User.objects.create_user('shopper')
+        add_or_update_cart(user, product, small, 1)
+
+        report = self.import_row([self.variant([self.small]), self.variant([self.large])])
+
+        self.assertEqual((report.unchanged, report.updated, report.variants, report.variants_unchanged), (1, 0, 0, 2))
+        self.assertEqual(Cart.objects.get(user=user).variant_id, small.pk)
+
+    def test_reimport_updates_and_deletes_only_changed_variants(self):
+        self.import_row([self.variant([self.small]), self.variant([self.large])])
+        small = VariantDetail.objects.get(option_signature=str(self.small.pk))
+
+        report = self.import_row([self.variant([self.small], current_price='80.00')])
+
+        self.assertEqual((report.updated, report.variants, report.variants_deleted), (1, 1, 1))
+        self.assertEqual(list(VariantDetail.objects.values_list('id', 'current_price')), [(small.pk, Decimal('80.00'))])
+
+
+class ProductVariantLookupTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('shopper'))
+        self.product = create_product(Category.objects.create(name='Candles'))
+
+    def test_invalid_options_are_bad_requests(self):
+        too_long = ','.join(str(option_id) for option_id in range(1000, 1100))
+        for options in ('', '0', '3,x', '\u00b2', '-1', too_long, '9' * 5000):
+            response = self.client.get(f'/api/products/{self.product.pk}/variant/', {'options': options})
+            self.assertEqual(response.status_code, 400, options[:20])
@@ -13,6 +13,10 @@ urlpatterns = [
     path('products/category/<int:category_id>/', ProductListByCategoryView.as_view(), name='product-by-category'),
     path('products/create/', ProductCreateView.as_view(), name='product-create'),
     path('products/all/', ProductListView.as_view(), name='products-list'),
+    path('products/search/', ProductSearchView.as_view(), name='product-search'),
+    path('products/facets/', ProductFacetsView.as_view(), name='product-facets'),
+    path('products/import/', CatalogImportView.as_view(), name='product-import'),
+    path('products/export/', CatalogExportView.as_view(), name='product-export'),
 
 
     #User
@@ -22,6 +26,7 @@ urlpatterns = [
     #Variant
     path('variant-types/', VariantTypeCreateListView.as_view(), name='variant-type-list-create'),
     path('variant-options/', VariantOptionCreateListView.as_view(), name='variant-option-list-create'),
+    path('products/<int:product_id>/variant/', ProductVariantLookupView.as_view(), name='product-variant-lookup'),
 
 
     #Ckecking
@@ -36,6 +41,7 @@ urlpatterns = [
     #Cart
     path('cart/', CartListView.as_view(), name='cart-list'),
     path('cart/add/', AddToCartView.as_view(), name='add-to-cart'),
+    path('cart/batch/', CartBatchView.as_view(), name='cart-batch'),
     path('cart/remove/<int:product_id>/', RemoveFromCartView.as_view(), name='remove-from-cart'),
     path('cart/remove/<int:product_id>/<int:variant_id>/', RemoveFromCartView.as_view(), name='remove-from-cart-variant'),
     path('cart/update/<int:product_id>/', UpdateCartQuantityView.as_view(), name='update-cart-quantity'),
@@ -62,6 +68,8 @@ urlpatterns = [
     path('offers/<int:pk>/', OfferDetailView.as_view(), name='offer-detail'),  # GET retrieve an offer
     path('offers/<int:pk>/update/', OfferUpdateView.as_view(), name='offer-update'),  # PUT or PATCH update an offer
     path('offers/<int:pk>/delete/', OfferDeleteView.as_view(), name='offer-delete'),  # DELETE remove an offer
+    path('offers/schedule/', OfferScheduleView.as_view(), name='offer-schedule'),  # POST create a batch of offers
+    path('offers/simulate/', OfferSimulationView.as_view(), name='offer-simulate'),  # POST preview discounts across the catalog
 
 
     #Coupen
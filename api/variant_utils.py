@@ -0,0 +1,66 @@
+from .models import VariantDetail
+from .pricing_utils import OfferResolver
+
+VariantOptionLink = VariantDetail.variant_options.through
+
+
+OPTION_SIGNATURE_MAX_LENGTH = VariantDetail._meta.get_field('option_signature').max_length
+
+
+def parse_option_ids(value):
+    """
+    Option ids from '3,7,12'; None when any of them is not a positive integer
+    or their signature would not fit option_signature, so no variant has it.
+    """
+    parts = [part.strip() for part in (value or '').split(',') if part.strip()]
+    # isdigit() accepts characters such as '²' that int() rejects
+    if not parts or not all(part.isdecimal() and len(part) <= OPTION_SIGNATURE_MAX_LENGTH for part in parts):
+        return None
+    option_ids = [int(part) for part in parts]
+    if 0 in option_ids or len(VariantDetail.build_option_signature(option_ids)) > OPTION_SIGNATURE_MAX_LENGTH:
+        return None
+    return option_ids
+
+
+def refresh_option_signatures(variant_ids):
+    """
+    Recomputes option_signature of the given variants from their option
+    links and returns {variant id: signature}.
+    """
+    variant_ids = set(variant_ids)
+    if not variant_ids:
+        return {}
+    options = {variant_id: [] for variant_id in variant_ids}
+    links = VariantOptionLink.objects.filter(variantdetail_id__in=variant_ids)
+    for variant_id, option_id in links.values_list('variantdetail_id', 'variantoption_id'):
+        options[variant_id].append(option_id)
+    variants = [
+        VariantDetail(id=variant_id, option_signature=VariantDetail.build_option_signature(option_ids))
+        for variant_id, option_ids in options.items()
+    ]
+    VariantDetail.objects.bulk_update(variants, ['option_signature'])
+    return {variant.id: variant.option_signature for variant in variants}
+
+
+def bulk_create_variants(variants, resolver=None):
+    """
+    Creates variants and their option links with one insert each.
+    `variants` is a list of (unsaved VariantDetail, option ids) pairs whose
+    product is set; effective prices and option signatures are filled in here
+    since bulk inserts skip the save and m2m_changed hooks.
+    """
+    if not variants:
+        return []
+    resolver = resolver or OfferResolver()
+    for variant, option_ids in variants:
+        variant.effective_price = resolver.get_effective_price(
+            variant.product_id, variant.product.category_id, variant.current_price
+        )
+        variant.option_signature = VariantDetail.build_option_signature(option_ids)
+    created = VariantDetail.objects.bulk_create([variant for variant, _ in variants])
+    VariantOptionLink.objects.bulk_create([
+        VariantOptionLink(variantdetail_id=variant.pk, variantoption_id=option_id)
+        for variant, option_ids in variants
+        for option_id in dict.fromkeys(option_ids)
+    ])
+    return created
@@ -1,10 +1,13 @@
-
-from django.http import JsonResponse
+import hashlib
+from django.core.cache import cache
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.http import parse_etags
 from django.views import View
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework import generics
 from rest_framework.views import APIView
+from rest_framework.parsers import MultiPartParser
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework.permissions import AllowAny
 from drf_yasg.utils import swagger_auto_schema
@@ -12,7 +15,19 @@ from rest_framework.permissions import IsAuthenticated
 
 from .otp_utils import verify_otp, get_or_create_user, issue_jwt_token
 from .serializers import *
-from .paginations import ProductPagination
+from .paginations import ProductPagination, ProductSearchPagination
+from .category_utils import get_category_tree_data
+from .product_filters import (
+    PRODUCT_LIST_FIELDS, filter_products, get_product_facets, requested_product_fields, with_product_details,
+)
+from .pricing_utils import active_offer_index, simulate_offers
+from .cache_utils import get_cache_version, product_version_key
+from .search_utils import search_highlights, search_product_ids
+from .variant_utils import parse_option_ids
+from .catalog_utils import (
+    CATALOG_FORMATS, detect_catalog_format, gzip_stream, import_catalog, iter_catalog_export, open_catalog_upload,
+    read_catalog_rows,
+)
 # Create your views here.
 
 ############################## Category View ##############################
@@ -22,10 +37,12 @@ class CategoryCreateView(generics.CreateAPIView):
     serializer_class = CategorySerializer
 
     def post(self, request, *args, **kwargs):
-        serializer = self.get_serializer(data=request.data)
+        # A list of category trees is imported in one transaction
+        many = isinstance(request.data, list)
+        serializer = self.get_serializer(data=request.data, many=many)
         if serializer.is_valid():
             category = serializer.save()
-            return Response(CategorySerializer(category).data, status=status.HTTP_201_CREATED)
+            return Response(CategorySerializer(category, many=many).data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 class CategoryListView(generics.ListAPIView):
@@ -34,6 +51,10 @@ class CategoryListView(generics.ListAPIView):
     def get_queryset(self):
         return Category.objects.filter(is_active = True, parent__isnull=True)
 
+    def list(self, request, *args, **kwargs):
+        # The whole tree is built from one query and cached until a category changes
+        return Response(get_category_tree_data())
+
 class CategoryUpdateView(generics.UpdateAPIView):
     queryset = Category.objects.all()
     serializer_class = CategoryUpdateSerializer
@@ -53,25 +74,183 @@ class ProductCreateView(generics.CreateAPIView):
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
             product = serializer.save()
+            # Reloaded with its variants prefetched so rendering them doesn't query per variant
+            product = with_product_details(Product.objects.filter(pk=product.pk)).get()
             return Response(ProductSerializer(product).data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+
+class ProductFieldsMixin:
+    """
+    Sparse fieldsets for ProductSerializer views: ?fields=a,b limits the
+    representation and the loaded columns, ?expand=variants adds variants.
+    """
+    default_fields = None  # Every field
+
+    def get_product_fields(self):
+        return requested_product_fields(self.request.query_params, self.default_fields)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['fields'] = self.get_product_fields()
+        return context
+
     
-class ProductListView(generics.ListAPIView):
+class ProductListView(ProductFieldsMixin, generics.ListAPIView):
     queryset = Product.objects.all()  
     serializer_class = ProductSerializer
     pagination_class = ProductPagination 
+    default_fields = PRODUCT_LIST_FIELDS
 
-class ProductListByCategoryView(generics.ListAPIView):
+    def get_queryset(self):
+        queryset = filter_products(Product.objects.all(), self.request.query_params)
+        return with_product_details(queryset, self.get_product_fields())
+
+class ProductListByCategoryView(ProductFieldsMixin, generics.ListAPIView):
     serializer_class = ProductSerializer
     pagination_class = ProductPagination  
+    default_fields = PRODUCT_LIST_FIELDS
+
     def get_queryset(self):
         category = self.kwargs['category_id']
-        return Product.objects.filter(category__id=category)
+        if self.request.query_params.get('include_descendants', '').lower() in ('1', 'true', 'yes'):
+            # Products of the whole visible subtree through the indexed category path
+            path = Category.objects.filter(id=category).values_list('path', flat=True).first()
+            if path is None:
+                return filter_products(Product.objects.none(), self.request.query_params)
+            queryset = Product.objects.filter(category_id__in=Category.objects.filter(
+                Category.subtree_q(path), is_visible=True
+            ).values('id'))
+        else:
+            queryset = Product.objects.filter(category__id=category)
+        return with_product_details(filter_products(queryset, self.request.query_params), self.get_product_fields())
     
-class ProductDetailView(generics.RetrieveAPIView):
+class ProductDetailView(ProductFieldsMixin, generics.RetrieveAPIView):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
+    cache_timeout = 60 * 60
+
+    def get_queryset(self):
+        return with_product_details(Product.objects.all(), self.get_product_fields())
+
+    def get_etag(self):
+        """
+        Strong ETag built from cache state only: the product's version (bumped
+        when it, its variants or its stored prices change), the offer index
+        version and the offer window the current time falls in.
+        """
+        product_id = self.kwargs['pk']
+        index = active_offer_index.refresh()
+        content_version = ':'.join(str(part) for part in (
+            product_id,
+            get_cache_version(product_version_key(product_id)),
+            index.version,
+            index.next_change.isoformat() if index.next_change else '',
+            self.request.query_params.get('fields', ''),
+            self.request.query_params.get('expand', ''),
+        ))
+        return '"%s"' % hashlib.sha1(content_version.encode()).hexdigest()
+
+    def retrieve(self, request, *args, **kwargs):
+        etag = self.get_etag()
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        cache_key = f"product_detail:{etag}"
+        data = cache.get(cache_key)
+        if data is None:
+            data = super().retrieve(request, *args, **kwargs).data
+            cache.set(cache_key, data, timeout=self.cache_timeout)
+        return Response(data, headers={'ETag': etag})
+
+class ProductFacetsView(APIView):
+    """
+    Facet counts for the catalog under the same filters as products/all/:
+    ?color=, ?fragrance=, ?burning_time=, ?category= (comma separated),
+    ?min_price= and ?max_price=.
+    """
+    def get(self, request):
+        return Response(get_product_facets(request.query_params))
+
+class ProductSearchView(ProductFieldsMixin, generics.ListAPIView):
+    """
+    Ranked full-text search over name, description, tags, fragrance and color.
+    Matches are ranked in the database, then only the requested page is
+    loaded and highlighted.
+    """
+    serializer_class = ProductSearchResultSerializer
+    pagination_class = ProductSearchPagination
+    default_fields = PRODUCT_LIST_FIELDS
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if context['fields'] is not None:
+            context['fields'] = set(context['fields']) | {'search_rank', 'highlight'}
+        return context
+
+    def list(self, request, *args, **kwargs):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'q': 'A search query is required.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        hits = self.paginate_queryset(search_product_ids(query))
+        ranks = dict(hits)
+        products = with_product_details(Product.objects.filter(pk__in=ranks), self.get_product_fields()).in_bulk()
+        highlights = search_highlights(query, ranks)
+
+        results = []
+        for product_id, rank in hits:
+            product = products.get(product_id)
+            if product is None:  # Deleted since the index was read
+                continue
+            product.search_rank = rank
+            product.search_highlight = highlights.get(product_id)
+            results.append(product)
+        serializer = self.get_serializer(results, many=True)
+        return self.get_paginated_response(serializer.data)
+
+class CatalogImportView(APIView):
+    """
+    Imports a CSV or JSONL catalog uploaded as `file`, see the import_catalog
+    command. The format comes from ?type=csv|jsonl or the file name.
+    """
+    parser_classes = [MultiPartParser]
+
+    def post(self, request):
+        uploaded = request.FILES.get('file')
+        if uploaded is None:
+            return Response({'file': 'A catalog file is required.'}, status=status.HTTP_400_BAD_REQUEST)
+        fmt = request.query_params.get('type') or detect_catalog_format(uploaded.name)
+        if fmt not in CATALOG_FORMATS:
+            return Response(
+                {'type': f"Expected one of {', '.join(CATALOG_FORMATS)}."}, status=status.HTTP_400_BAD_REQUEST
+            )
+        report = import_catalog(read_catalog_rows(open_catalog_upload(uploaded), fmt))
+        return Response(report.as_dict(), status=status.HTTP_200_OK)
+
+class CatalogExportView(APIView):
+    """
+    Streams the whole catalog as ?type=csv or jsonl (default), optionally
+    gzip compressed with ?gzip=1.
+    """
+    content_types = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+    def get(self, request):
+        fmt = request.query_params.get('type', 'jsonl')
+        if fmt not in CATALOG_FORMATS:
+            return Response(
+                {'type': f"Expected one of {', '.join(CATALOG_FORMATS)}."}, status=status.HTTP_400_BAD_REQUEST
+            )
+        chunks = iter_catalog_export(fmt)
+        compress = request.query_params.get('gzip', '').lower() in ('1', 'true', 'yes')
+        response = StreamingHttpResponse(
+            gzip_stream(chunks) if compress else (chunk.encode() for chunk in chunks),
+            content_type=f"{self.content_types[fmt]}; charset=utf-8",
+        )
+        if compress:
+            response['Content-Encoding'] = 'gzip'
+        response['Content-Disposition'] = f'attachment; filename="catalog.{fmt}"'
+        return response
 
 ############################## Variant ##################################
 
@@ -86,6 +265,23 @@ class VariantOptionCreateListView(generics.ListCreateAPIView):
     queryset = VariantOption.objects.all()
     serializer_class = VariantOptionSerializer
 
+# Resolve a product's variant from the selected options, e.g. ?options=3,7
+class ProductVariantLookupView(APIView):
+    def get(self, request, product_id):
+        option_ids = parse_option_ids(request.query_params.get('options'))
+        if option_ids is None:
+            return Response(
+                {'options': 'Expected a comma separated list of variant option ids.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        # One lookup on the (product, option_signature) index, with the product for offer pricing
+        variant = VariantDetail.objects.select_related('product').filter(
+            product_id=product_id, option_signature=VariantDetail.build_option_signature(option_ids)
+        ).first()
+        if variant is None:
+            return Response({'detail': 'No variant with these options.'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(VariantLookupSerializer(variant).data)
+
 ############################## Wishlist ##################################
 
 # Add product to wishlist
@@ -135,8 +331,13 @@ class AddToCartView(generics.CreateAPIView):
         quantity = int(request.data.get('quantity', 1))
 
         try:
-            product = Product.objects.get(id=product_id)
-            variant = VariantDetail.objects.get(id=variant_id) if variant_id else None
+            # One lookup: a variant brings its product along, and must belong to it
+            if variant_id:
+                variant = VariantDetail.objects.select_related('product').get(id=variant_id, product_id=product_id)
+                product = variant.product
+            else:
+                variant = None
+                product = Product.objects.get(id=product_id)
 
             add_or_update_cart(user=user, product=product, variant=variant, quantity=quantity)
             return Response({"message": "Cart updated successfully"}, status=status.HTTP_200_OK)
@@ -171,6 +372,19 @@ class CartListView(generics.ListAPIView):
         return Cart.objects.filter(user=self.request.user, is_active=True)
 
 
+# Apply a list of add/set/remove operations and return the resulting cart
+class CartBatchView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        serializer = CartBatchSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        apply_cart_operations(request.user, serializer.validated_data['operations'])
+        cart_items = Cart.objects.filter(user=request.user, is_active=True).order_by('id')
+        return Response(CartSerializer(cart_items, many=True).data, status=status.HTTP_200_OK)
+
+
 # Update quantity of a cart item
 class UpdateCartQuantityView(generics.UpdateAPIView):
     serializer_class = CartSerializer
@@ -300,7 +514,7 @@ class ListOrdersView(generics.ListAPIView):
     permission_classes = [IsAuthenticated]
     @swagger_auto_schema(tags=['Orders'])
     def get_queryset(self):
-        return Order.objects.filter(user=self.request.user)
+        return Order.objects.filter(user=self.request.user).order_by('-created_at')
 
 # Order detail
 class OrderDetailView(generics.RetrieveAPIView):
@@ -354,6 +568,27 @@ class OfferDeleteView(generics.DestroyAPIView):
     queryset = Offer.objects.all()
     serializer_class = OfferSerializer
 
+class OfferScheduleView(generics.CreateAPIView):
+    queryset = Offer.objects.all()
+    serializer_class = OfferSerializer
+
+    def post(self, request, *args, **kwargs):
+        # Validates and creates a batch of offers in one pass
+        serializer = self.get_serializer(data=request.data, many=True)
+        if serializer.is_valid():
+            offers = serializer.save()
+            return Response(OfferSerializer(offers, many=True).data, status=status.HTTP_201_CREATED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+class OfferSimulationView(APIView):
+    @swagger_auto_schema(request_body=OfferSimulationSerializer)
+    def post(self, request):
+        serializer = OfferSimulationSerializer(data=request.data)
+        if serializer.is_valid():
+            result = simulate_offers(serializer.validated_data['discounts'], top=serializer.validated_data['top'])
+            return Response(result, status=status.HTTP_200_OK)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
 ############################ Coupen ##########################
 # List all coupons
 class CouponListView(generics.ListCreateAPIView):
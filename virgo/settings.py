@@ -99,6 +99,8 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # Threads can't share an in-memory test database, the cart concurrency tests need a file
+        "TEST": {"NAME": BASE_DIR / "test_db.sqlite3"},
     }
 }
 
@@ -150,6 +152,13 @@ USE_TZ = True
 
 STATIC_URL = "static/"
 
+# Uploaded files, see api/image_utils.py for the derivatives generated from images
+MEDIA_URL = "media/"
+MEDIA_ROOT = BASE_DIR / "media"
+
+# Uploads above 1 MB are streamed to a temporary file instead of being held in memory
+FILE_UPLOAD_MAX_MEMORY_SIZE = 1024 * 1024
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -289,8 +298,23 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_BROKER_CONNECTION_RETRY_ON_STARTUP = True
+# Safety net for effective price refreshes lost to a broker outage or a missed ETA job
+CELERY_BEAT_SCHEDULE = {
+    'refresh-effective-prices': {
+        'task': 'api.tasks.refresh_effective_prices_task',
+        'schedule': 15 * 60,
+    },
+}
+
 
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://redis:6379/1',
+    }
+}
+
 
 ASGI_APPLICATION = 'virgo.asgi.application'
 